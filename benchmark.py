@@ -0,0 +1,255 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+""" Micro benchmarks for the calendar backend and the GUI.
+Usage: python benchmark.py [name ...]
+The GUI benchmarks (cards, decorations) need Kivy. """
+
+from data.event_index import sort_events
+from data.events import Situation, SimpleEvent
+import gc
+from data.isodate import parse_datetime
+from datetime import datetime
+import random
+import sys
+import time
+
+def timed(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+def random_events(count, seed=42):
+    rng = random.Random(seed)
+    events = []
+    for i in xrange(count):
+        start = 1400000000 + rng.randint(0, 3600 * 24 * 30)
+        end = start + rng.randint(15, 180) * 60
+        events.append(SimpleEvent("Event {}".format(i), start, end, google_id=str(i)))
+    return events
+
+def bubble_sort_events(events):
+    """ The sort used before the (start, end, id) sort stage. """
+    changed = True
+    while changed:
+        changed = False
+        for i in xrange(len(events) -1):
+            if events[i].start > events[i+1].start:
+                changed = True
+                temp = events[i+1]
+                events[i+1] = events[i]
+                events[i] = temp
+    return events
+
+def benchmark_sort():
+    print "{:>6} {:>12} {:>12}".format("events", "bubble", "sorted()")
+    for count in (100, 1000, 2000, 5000, 10000):
+        events = random_events(count)
+        bubble = "-"
+        if count <= 2000:
+            bubble = "{:.4f}s".format(timed(bubble_sort_events, list(events)))
+        shuffled = timed(sort_events, list(events))
+        print "{:>6} {:>12} {:>11.4f}s".format(count, bubble, shuffled)
+
+class DictEvent():
+    """ The event record used before SimpleEvent had slots. """
+    def __init__(self, title="", start=0, end=0, description="", location="", google_id=""):
+        self.title = title
+        self.description = description
+        self.start = start
+        self.end = end
+        self.location = location
+        self.google_id = google_id
+
+def record_size(event):
+    """ Size of the record itself without the shared field values. """
+    size = sys.getsizeof(event)
+    if hasattr(event, "__dict__"):
+        size += sys.getsizeof(event.__dict__)
+    return size
+
+def benchmark_memory():
+    count = 100000
+    events = random_events(count)
+    slotted = sum(record_size(event) for event in events)
+    legacy = [DictEvent(event.title, event.start, event.end, google_id=event.google_id) for event in events]
+    dict_based = sum(record_size(event) for event in legacy)
+    print "{} events: {:.1f} MB with __dict__, {:.1f} MB with __slots__".format(
+        count, dict_based / 1e6, slotted / 1e6)
+    cards = events[:1000]
+    first = timed(lambda: [(event.start_time, event.end_time) for event in cards])
+    second = timed(lambda: [(event.start_time, event.end_time) for event in cards])
+    print "formatting 1000 card times: {:.4f}s first, {:.4f}s cached".format(first, second)
+
+def strptime_to_seconds(ts):
+    """ The timestamp conversion used before data.isodate, ignores the offset. """
+    dt = datetime.strptime(ts[:-7],'%Y-%m-%dT%H:%M:%S')
+    return time.mktime(dt.timetuple())
+
+def benchmark_isodate():
+    events = random_events(100000)
+    dump = []
+    for event in events:
+        for seconds in (event.start, event.end):
+            dump.append(datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%dT%H:%M:%S') + "+00:00")
+    legacy = timed(lambda: [strptime_to_seconds(ts) for ts in dump])
+    fast = timed(lambda: [parse_datetime(ts) for ts in dump])
+    print "{} timestamps: strptime {:.3f}s, isodate {:.3f}s ({:.1f}x)".format(
+        len(dump), legacy, fast, legacy / fast)
+
+def random_situations(count, seed=7):
+    rng = random.Random(seed)
+    events = random_events(count * 3)
+    return [Situation(*[rng.choice((None, event)) for event in events[i * 3:i * 3 + 3]])
+            for i in xrange(count)]
+
+def rebuild_cards(gui, situation):
+    """ The card handling used before the card pool: new cards on every change. """
+    import main
+    for layout in (gui.layout_last_event, gui.layout_current_event, gui.layout_next_event):
+        layout.clear_widgets()
+    if situation.last:
+        gui.layout_last_event.add_widget(main.NoneCurrentEventCard(situation.last))
+    if situation.current:
+        gui.layout_current_event.add_widget(main.CurrentEventCard(situation.current))
+    else:
+        gui.layout_current_event.add_widget(main.BreakCard())
+    if situation.next:
+        gui.layout_next_event.add_widget(main.NoneCurrentEventCard(situation.next))
+
+def load_gui_rules():
+    """ Loads scholaris.kv once for all GUI benchmarks. """
+    from kivy.lang import Builder
+    if not any(name.endswith("scholaris.kv") for name in Builder.files):
+        Builder.load_file("scholaris.kv")
+
+def benchmark_cards():
+    from kivy.uix.widget import Widget
+    import main
+    load_gui_rules()
+    situations = random_situations(300)
+    created = [0]
+    original_init = Widget.__init__
+    def counting_init(self, **kwargs):
+        created[0] += 1
+        original_init(self, **kwargs)
+    Widget.__init__ = counting_init
+    try:
+        gui = main.GUI()
+        pool = main.CardPool(gui)
+        for name, swap in (("rebuild", lambda situation: rebuild_cards(gui, situation)),
+                           ("pool", pool.show)):
+            gc.collect()
+            objects = len(gc.get_objects())
+            created[0] = 0
+            seconds = timed(lambda: [swap(situation) for situation in situations])
+            gc.collect()
+            print "{:>8}: {:.2f} ms per swap, {:.1f} widgets created per swap, {} objects kept".format(
+                name, seconds * 1000 / len(situations), created[0] / float(len(situations)),
+                len(gc.get_objects()) - objects)
+    finally:
+        Widget.__init__ = original_init
+
+# the CircleDecoration rule used before the decorations were drawn as meshes
+# and a break card that shows it like BreakCard shows the CircleDecoration
+LINE_CIRCLE_RULES = """
+<LineBreakCard>:
+    BreakLabel:
+        font_size: "26sp"
+        text: root.time_left_string
+    LineCircleDecoration:
+        size_hint: (None, None)
+        size: min(root.width, root.height) * 0.9, min(root.width, root.height) * 0.9
+        color_0: (1, 1, 1, 0.6) if root.marker_pos < 0.5 else (1, 0, 0, 0.6)
+        color_1: (1, 1, 1, 0.75) if root.marker_pos < 0.75 else (1, 0, 0, 0.75)
+        color_2: (1, 1, 1, 0.9) if root.marker_pos < 0.9 else (1, 0, 0, 0.9)
+
+<LineCircleDecoration>:
+    canvas:
+        Color:
+            rgba: root.color_0
+        Line:
+            circle: self.center_x, self.center_y, self.width * 0.5 + dp(10), root.angle_0 * root.direction_0, root.angle_0 * root.direction_0 + root.segment_width_0
+            width: dp(3.5)
+            cap: "none"
+        Color:
+            rgba: root.color_1
+        Line:
+            circle: self.center_x, self.center_y, self.width * 0.5 + dp(25), root.angle_1 * root.direction_1, root.angle_1 * root.direction_1 + root.segment_width_1
+            width: dp(3.5)
+            cap: "none"
+        Color:
+            rgba: root.color_2
+        Line:
+            circle: self.center_x, self.center_y, self.width * 0.5 + dp(40), root.angle_2 * root.direction_2, root.angle_2 * root.direction_2 + root.segment_width_2
+            width: dp(3.5)
+            cap: "none"
+"""
+
+def benchmark_decorations():
+    from kivy.base import EventLoop
+    from kivy.clock import Clock
+    from kivy.factory import Factory
+    from kivy.lang import Builder
+    from kivy.properties import NumericProperty, StringProperty
+    from kivy.uix.anchorlayout import AnchorLayout
+    from kivy.uix.gridlayout import GridLayout
+    from data import decorations
+    import main
+    class LineCircleDecoration(decorations.RotatingDecoration):
+        pass
+    class LineBreakCard(AnchorLayout):
+        time_left_string = StringProperty("")
+        marker_pos = NumericProperty(0)
+    Factory.register("LineCircleDecoration", cls=LineCircleDecoration)
+    Factory.register("LineBreakCard", cls=LineBreakCard)
+    load_gui_rules()
+    Builder.load_string(LINE_CIRCLE_RULES)
+    EventLoop.ensure_window()
+    window = EventLoop.window
+    frames = 300
+    for name, card_class in (("kv lines", LineBreakCard), ("meshes", main.BreakCard)):
+        # 50 break cards on screen, each with its circle decoration
+        grid = GridLayout(cols=10, size=window.size)
+        for i in xrange(50):
+            grid.add_widget(card_class(time_left_string="{}m 30s".format(i)))
+        window.add_widget(grid)
+        for i in xrange(3):
+            # layout and first upload are not measured
+            Clock.tick()
+            window.dispatch("on_draw")
+        now = Clock.get_time()
+        update_seconds = draw_seconds = 0
+        for frame in xrange(frames):
+            now += 1 / 60.0
+            start = time.time()
+            for decoration in decorations.animator.decorations:
+                decoration.update_phases(now)
+            update_seconds += time.time() - start
+            start = time.time()
+            window.dispatch("on_draw")
+            window.dispatch("on_flip")
+            draw_seconds += time.time() - start
+        window.remove_widget(grid)
+        print "{:>8}: {:.2f} ms per frame with 50 decorated cards ({:.2f} ms update, {:.2f} ms draw)".format(
+            name, (update_seconds + draw_seconds) * 1000 / frames,
+            update_seconds * 1000 / frames, draw_seconds * 1000 / frames)
+
+BENCHMARKS = {
+    "cards": benchmark_cards,
+    "decorations": benchmark_decorations,
+    "isodate": benchmark_isodate,
+    "sort": benchmark_sort,
+    "memory": benchmark_memory,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    for name in names:
+        print "== {} ==".format(name)
+        try:
+            BENCHMARKS[name]()
+        except ImportError as e:
+            print "skipped: {}".format(e)
@@ -3,17 +3,24 @@
 #
 # Copyright Tim Henning 2014
 
+from data.event_cache import CacheLock, EventCacheReader, EventCacheError, write_cache
+from data.event_index import EventIndex, merge_events
+from data.event_pager import EventPager, PAGE_SIZE
+from data.event_store import EventStore, day_start, day_end
+from data.events import SimpleEvent
+# the Google client modules are imported where they are needed, so a display
+# that starts from the event cache does not load them before the first frame
+from data.refresh_worker import RefreshWorker
+from data.scheduler import AdaptivePollScheduler
+from data.startup_profile import phase
 from datetime import datetime, timedelta, date
-from googleapiclient.discovery import build
-from oauth2client.client import OAuth2WebServerFlow
-from oauth2client.file import Storage
-from oauth2client.tools import run_flow, argparser
 import argparse
-import httplib2
+import hashlib
 import inspect
+import json
 import os
-import pickle
 import sys
+import threading
 import time
 
 OAUTH2_CLIENT_ID = "Your API client ID here"
@@ -23,13 +30,59 @@ CALENDAR_HOTWORDS = ("college", "university", "school",
                      "schule", "studium",
                      u"école", "ecole", u"collège", u"étude", "etude")
 
+# the chosen calendar is saved next to the credentials and revalidated
+# in the background when the last check is older than this (seconds)
+CALENDAR_CHOICE_FILE = "calendar_id.dat"
+CALENDAR_REVALIDATE_INTERVAL = 3600
+CALENDAR_LIST_FIELDS = "etag,items(id,summary)"
+
+# ids of calendars that are displayed together, e.g. all rooms of a building;
+# if empty, one calendar is chosen by the hotwords
+CALENDAR_IDS = ()
+
+# requests of a sync are sent together, the Calendar API
+# accepts at most BATCH_LIMIT requests per batch
+BATCH_URI = "https://www.googleapis.com/batch/calendar/v3"
+BATCH_LIMIT = 50
+
+# days before and after today that are kept in the event store
+WINDOW_DAYS_BEFORE = 1
+WINDOW_DAYS_AFTER = 7
+
+# processes sharing the cache directory write their caches one at a time
+CACHE_LOCK_FILE = "event_cache.lock"
+CACHE_LOCK_TIMEOUT = 10
+
+EVENT_LIST_FIELDS = "etag,nextPageToken,nextSyncToken,items(id,status,summary,start,end,description,location)"
+
+class SyncError(Exception):
+    """ The Calendar API could not be reached or some requests of a sync failed. """
+    pass
+
 class GoogleCalendarBackend():
     """ Calendar backend for Google Calendar. Uses OAuth2.0. """
-    def __init__(self):
+    pushes_situations = False
+    
+    def __init__(self, days_before=WINDOW_DAYS_BEFORE, days_after=WINDOW_DAYS_AFTER,
+                 calendar_ids=CALENDAR_IDS):
         self.script_dir = self.get_script_dir()
+        self.days_before = days_before
+        self.days_after = days_after
         self.calendar_service = None
         self.calendar_id = None
+        self.aggregated_calendar_ids = calendar_ids
+        self.credentials = None
         self.authentication_tried = False
+        self.stores = {}
+        self.cached_states = {}  # calendar id -> state of the store in its cache file
+        self.event_index = None  # (key, EventIndex), replaced as a whole
+        self.sync_lock = threading.RLock()
+        self.notification_lock = threading.Lock()
+        self.prefetch_thread = None
+        self.push_receiver = None
+        self.poll_scheduler = AdaptivePollScheduler()
+        self.synced_at = None  # time of the last successful sync or of the cache it left
+        self.notified_calendar_ids = set()
     
     def get_script_dir(self, follow_symlinks=True):
         if getattr(sys, 'frozen', False): # py2exe, PyInstaller, cx_Freeze
@@ -48,49 +101,75 @@ class GoogleCalendarBackend():
         self.authentication_tried = True
         try:
             self.calendar_service = self.get_calendar_service_object()
-            self.calendar_id = self.get_calendar_id()
+            if self.aggregated_calendar_ids:
+                return
+            choice = self.load_calendar_choice()
+            if choice:
+                self.set_calendar_id(choice["id"])
+            else:
+                self.set_calendar_id(self.get_calendar_id())
         except Exception as e:
             print e
             self.calendar_service = None
             self.calendar_id = None
     
     def get_calendar_service_object(self):
+        with phase("import google client"):
+            from googleapiclient.discovery import build
+            from oauth2client.client import OAuth2WebServerFlow
+            from oauth2client.file import Storage
+            from oauth2client.tools import run_flow, argparser
+            import httplib2
         flow = OAuth2WebServerFlow(
             client_id=OAUTH2_CLIENT_ID,
             client_secret=OAUTH2_CLIENT_SECRET,
             scope='https://www.googleapis.com/auth/calendar',
             user_agent='Scholaris/0.1')
         
-        storage = Storage('calendar.dat')
-        credentials = storage.get()
-        if credentials is None or credentials.invalid:
-            parser = argparse.ArgumentParser(parents=[argparser])
-            flags = parser.parse_args()
-            credentials = run_flow(flow, storage, flags)
+        with phase("authentication"):
+            storage = Storage('calendar.dat')
+            credentials = storage.get()
+            if credentials is None or credentials.invalid:
+                parser = argparse.ArgumentParser(parents=[argparser])
+                flags, unknown = parser.parse_known_args()
+                credentials = run_flow(flow, storage, flags)
         
+        self.credentials = credentials
         http = httplib2.Http(disable_ssl_certificate_validation=True)
         http = credentials.authorize(http)
         
-        service = build(serviceName='calendar', version='v3', http=http)
+        with phase("discovery"):
+            service = build(serviceName='calendar', version='v3', http=http)
         return service
     
     def logout(self):
+        from oauth2client.file import Storage
         try:
             Storage('calendar.dat').delete()
-            path = os.path.join(self.script_dir, "event_cache")
-            if os.path.isfile(path):
-                os.remove(path)
+            if os.path.isfile(CALENDAR_CHOICE_FILE):
+                os.remove(CALENDAR_CHOICE_FILE)
+            for name in os.listdir(self.script_dir or "."):
+                if name.startswith("event_cache"):
+                    os.remove(os.path.join(self.script_dir, name))
+            self.cached_states.clear()
         except Exception as e:
             print e
     
     def get_calendar_id(self):
-        """ Tries to guess the calendar containing timetable like events by hotwords. """
+        """ Tries to guess the calendar containing timetable like events by hotwords.
+        The choice is saved next to the credentials. """
         if not self.authentication_tried:
             self.authenticate()
         service = self.calendar_service
         if not service:
             return ""
-        response = service.calendarList().list(fields="items/summary,items/id").execute()
+        response = self.calendar_list_request().execute()
+        calendar_id = self.choose_calendar(response)
+        if calendar_id:
+            self.save_calendar_choice(calendar_id, response.get("etag"))
+        return calendar_id
+    
+    def choose_calendar(self, response):
         if not response.has_key("items"):
             return None
         print 'Found %d calendars:' % len(response['items'])
@@ -104,152 +183,431 @@ class GoogleCalendarBackend():
         print "Chose: {}".format(response['items'][0]["summary"])
         return response['items'][0]["id"]
     
-    def get_events_today(self):
-        path = os.path.join(self.script_dir, "event_cache")
-        if not os.path.isfile(path):
-            return self.get_events_from_day(date.today())
+    def load_calendar_choice(self):
         try:
-            file_object = open(path, 'r')
-            content = pickle.load(file_object)
+            file_object = open(CALENDAR_CHOICE_FILE, 'r')
+            choice = json.load(file_object)
             file_object.close()
-        except IOError:
-            print "Error while reading file {}.".format(path)
-            return self.get_events_from_day(datetime.now())
-        file_date, events = content
-        if file_date == date.today():
-            print "Successfully read events from cache."
-            return events
-        else:
-            return self.get_events_from_day(date.today())
+        except (IOError, ValueError):
+            return None
+        if not isinstance(choice, dict) or not choice.get("id"):
+            return None
+        choice.setdefault("etag", None)
+        choice.setdefault("checked_at", 0)
+        return choice
     
-    def get_events_from_day(self, day):
-        if not self.authentication_tried:
-            self.authenticate()
-        if not self.calendar_service or not self.calendar_id:
-            return []
-        timeMin = (datetime(year=day.year, month=day.month, day=day.day)).isoformat() + "Z"
-        timeMax = (datetime(year=day.year, month=day.month, day=day.day) + timedelta(days=1)).isoformat() + "Z"
-        response = self.calendar_service.events().list(fields="items/summary,items/start,items/end,items/id,items/description,items/location", calendarId=self.calendar_id, orderBy="startTime", singleEvents=True, timeMin=timeMin, timeMax=timeMax, maxResults=100).execute()
-        if not response.has_key("items"):
-            self.update_cache([])
-            return []
-        self.update_cache(response["items"])
-        return response["items"]
-    
-    def update_cache(self, events):
-        path = os.path.join(self.script_dir, "event_cache")
-        content = (date.today(), events)
+    def save_calendar_choice(self, calendar_id, etag):
+        choice = {"id": calendar_id, "etag": etag, "checked_at": time.time()}
         try:
-            file_object = open(path, 'w')
-            pickle.dump(content, file_object)
+            file_object = open(CALENDAR_CHOICE_FILE, 'w')
+            json.dump(choice, file_object)
             file_object.close()
         except IOError:
+            print "Could not write to file %s." % CALENDAR_CHOICE_FILE
+    
+    def calendar_list_request(self, etag=None):
+        """ With an etag the request is conditional and fails with
+        an HttpError 304 if the calendar list did not change. """
+        request = self.calendar_service.calendarList().list(fields=CALENDAR_LIST_FIELDS)
+        if etag:
+            request.headers["If-None-Match"] = etag
+        return request
+    
+    def get_stale_choice(self):
+        """ Returns the saved calendar choice if it is due to be checked again.
+        It stays due until a check succeeded. """
+        if self.aggregated_calendar_ids:
+            return None
+        choice = self.load_calendar_choice()
+        if choice and time.time() - choice["checked_at"] > CALENDAR_REVALIDATE_INTERVAL:
+            return choice
+        return None
+    
+    def apply_calendar_list(self, choice, response, error):
+        """ Keeps the saved choice if the calendar list did not change
+        since then and chooses again if it did. Either way the choice
+        counts as checked. """
+        if error is not None:
+            if error.resp.status != 304:
+                raise error
+            self.save_calendar_choice(choice["id"], choice["etag"])
+            return 0
+        calendar_id = self.choose_calendar(response) or choice["id"]
+        self.save_calendar_choice(calendar_id, response.get("etag"))
+        # a new calendar gets its own store and is fetched on the next sync
+        self.set_calendar_id(calendar_id)
+        return 0
+    
+    def set_calendar_id(self, calendar_id):
+        """ Changes the chosen calendar, the push receiver then
+        watches the new one and stops the channel of the old one. """
+        if calendar_id == self.calendar_id:
+            return
+        self.calendar_id = calendar_id
+        if self.push_receiver:
+            self.push_receiver.wake_event.set()
+    
+    def get_calendar_ids(self):
+        """ Returns the ids of the calendars to display. Without configured
+        calendars this is the chosen one, which is known before authenticating
+        if it was saved before. """
+        if self.aggregated_calendar_ids:
+            return list(self.aggregated_calendar_ids)
+        if self.calendar_id:
+            return [self.calendar_id]
+        choice = self.load_calendar_choice()
+        if choice:
+            return [choice["id"]]
+        return []
+    
+    def get_store(self, calendar_id):
+        """ Returns the local event store of a calendar, read from the cache on first use. """
+        store = self.stores.get(calendar_id)
+        if store is None:
+            store = self.stores.setdefault(calendar_id, self.load_cache(calendar_id))
+        return store
+    
+    def get_stores(self):
+        return [self.get_store(calendar_id) for calendar_id in self.get_calendar_ids()]
+    
+    def get_window(self):
+        """ Returns the days of the rolling event window around today. """
+        today = date.today()
+        return [today + timedelta(days=i) for i in xrange(-self.days_before, self.days_after + 1)]
+    
+    def merge_snapshots(self, snapshots, first_day, last_day):
+        """ Merges the already ordered events of each snapshot with a k-way merge. """
+        start, end = day_start(first_day), day_end(last_day)
+        event_lists = [snapshot.events_between(start, end) for snapshot in snapshots]
+        if len(event_lists) == 1:
+            return event_lists[0]
+        return merge_events(event_lists)
+    
+    def ensure_window(self):
+        """ Serves the stores as they are (stale while revalidate). Only when
+        a poll is due, so not before a scheduled retry, a fetch blocks if there
+        is no data of the window at all and missing days are fetched in the
+        background. """
+        now = time.time()
+        if now < self.poll_scheduler.next_poll(now):
+            return
+        stores = self.get_stores()
+        if not any(store.snapshot.days for store in stores):
+            self.refresh()
+        elif any(store.snapshot.missing_days(self.get_window()) for store in stores):
+            self.start_prefetch()
+    
+    def start_prefetch(self):
+        if self.prefetch_thread and self.prefetch_thread.is_alive():
+            return
+        self.prefetch_thread = threading.Thread(target=self.refresh)
+        self.prefetch_thread.daemon = True
+        self.prefetch_thread.start()
+    
+    def start_push(self, webhook_url, on_change=None):
+        """ Opt-in push mode (see data/push.py): changes are fetched when Google
+        notifies them. on_change is called after a fetch that found changes. """
+        from data.push import PushReceiver
+        self.push_listener = on_change
+        self.push_worker = RefreshWorker(self.sync_notified_calendars, self.on_push_synced)
+        self.push_receiver = PushReceiver(self, webhook_url, self.on_push_notification)
+        self.push_receiver.start()
+    
+    def on_push_notification(self, calendar_id):
+        """ Called by the receiver thread, the fetch runs in the push worker
+        so Google gets its answer right away. """
+        with self.notification_lock:
+            self.notified_calendar_ids.add(calendar_id)
+        self.push_worker.request()
+    
+    def sync_notified_calendars(self):
+        with self.notification_lock:
+            calendar_ids = list(self.notified_calendar_ids)
+            self.notified_calendar_ids.clear()
+        with self.sync_lock:
+            return self.sync_calendars(calendar_ids, self.get_window())
+    
+    def on_push_synced(self, changes):
+        if changes and self.push_listener:
+            self.push_listener()
+    
+    def refresh(self):
+        """ Fetches the changes since the last sync and the missing days
+        of the window. Cheap if nothing changed. """
+        try:
+            changes = self.sync()
+        except Exception as e:
+            print e
+            self.poll_scheduler.record_failure(time.time())
+            return 0
+        self.poll_scheduler.record_poll(time.time(), changes)
+        return changes
+    
+    def get_stale_age(self, now):
+        """ Returns how old the displayed events are if the last refresh
+        failed, None while the backend is in sync or has no data at all. """
+        if not self.poll_scheduler.failures or self.synced_at is None:
+            return None
+        return now - self.synced_at
+    
+    def get_next_poll(self, now):
+        """ Returns when refresh should be called next. """
+        if self.push_receiver and not self.poll_scheduler.failures:
+            # changes are notified, polling is only a fallback
+            return (self.poll_scheduler.last_poll or now) + self.poll_scheduler.ceiling
+        return self.poll_scheduler.next_poll(now, self.get_next_transition(now))
+    
+    def sync(self):
+        """ Brings the stores of all calendars up to date for the window.
+        Returns the number of changes. """
+        with self.sync_lock:
+            if not self.calendar_service and self.may_authenticate():
+                self.authenticate()
+            if not self.calendar_service:
+                raise SyncError("Not connected to Google Calendar.")
+            calendar_ids = self.get_calendar_ids()
+            if not calendar_ids:
+                return 0
+            with phase("fetch"):
+                return self.sync_calendars(calendar_ids, self.get_window())
+    
+    def may_authenticate(self):
+        """ A failed authentication is tried again once there are credentials,
+        e.g. when only the network was down. Without credentials the user
+        declined to log in. """
+        return not self.authentication_tried or self.credentials is not None
+    
+    def sync_calendars(self, calendar_ids, window):
+        """ Brings the stores of the calendars up to date for the window.
+        The first page of every request, including a due revalidation of the
+        calendar choice, is sent in one batch, so syncing N calendars costs
+        one round trip plus one per further page. Returns the number of changes. """
+        requests = []
+        choice = self.get_stale_choice()
+        if choice:
+            requests.append((self.calendar_list_request(choice["etag"]),
+                             lambda response, error: self.apply_calendar_list(choice, response, error)))
+        for calendar_id in calendar_ids:
+            requests.extend(self.sync_requests(calendar_id, window))
+        results = self.execute_batched(requests)
+        for calendar_id in calendar_ids:
+            self.get_store(calendar_id).prune(window[0])
+            self.update_cache(calendar_id)
+        failures = results.count(None)
+        if failures:
+            raise SyncError("{} of {} requests failed.".format(failures, len(results)))
+        self.synced_at = time.time()
+        return sum(results)
+    
+    def sync_requests(self, calendar_id, window):
+        """ Returns the (request, callback) pairs that bring the store of a
+        calendar up to date. With a sync token from an earlier fetch only the
+        changed and deleted events and the days that entered the window are
+        requested, otherwise all events of the window. """
+        snapshot = self.get_store(calendar_id).snapshot
+        if not snapshot.sync_token:
+            request = self.window_request(calendar_id, window)
+            return [(request, lambda response, error:
+                     self.apply_full_sync(calendar_id, window, request, response, error))]
+        request = self.list_request(calendar_id, etag=snapshot.etag, syncToken=snapshot.sync_token)
+        requests = [(request, lambda response, error:
+                     self.apply_incremental(calendar_id, window, request, response, error))]
+        missing_days = snapshot.missing_days(window)
+        if missing_days:
+            days_request = self.window_request(calendar_id, missing_days)
+            requests.append((days_request, lambda response, error:
+                             self.apply_days(calendar_id, missing_days, days_request, response, error)))
+        return requests
+    
+    def execute_batched(self, requests):
+        """ Sends (request, callback) pairs in batches of up to BATCH_LIMIT
+        requests and calls callback(response, error) for every answer, error
+        being the HttpError of a failed request. Returns the results of the
+        callbacks, None for callbacks that raised. """
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import BatchHttpRequest
+        results = []
+        def make_callback(callback):
+            def on_response(request_id, response, error):
+                try:
+                    results.append(callback(response, error))
+                except Exception as e:
+                    print e
+                    results.append(None)
+            return on_response
+        if len(requests) == 1:
+            # a batch of one would not save a round trip
+            request, callback = requests[0]
+            try:
+                response, error = request.execute(), None
+            except HttpError as e:
+                response, error = None, e
+            make_callback(callback)(None, response, error)
+            return results
+        for i in xrange(0, len(requests), BATCH_LIMIT):
+            batch = BatchHttpRequest(batch_uri=BATCH_URI)
+            for request, callback in requests[i:i + BATCH_LIMIT]:
+                batch.add(request, callback=make_callback(callback))
+            batch.execute()
+        return results
+    
+    def apply_full_sync(self, calendar_id, days, request, response, error):
+        if error is not None:
+            raise error
+        pager = self.list_events(request, response)
+        events = self.get_simple_events(pager)
+        self.get_store(calendar_id).reset(events, pager.sync_token, days)
+        print "Fetched {} events.".format(len(events))
+        return len(events)
+    
+    def apply_days(self, calendar_id, days, request, response, error):
+        """ Adds the events of days that were not in the store yet.
+        Later changes of them are reported by the sync token of the store. """
+        if error is not None:
+            raise error
+        events = self.get_simple_events(self.list_events(request, response))
+        self.get_store(calendar_id).add_days(events, days)
+        print "Prefetched {} events of {} days.".format(len(events), len(days))
+        return len(events)
+    
+    def apply_incremental(self, calendar_id, window, request, response, error):
+        store = self.get_store(calendar_id)
+        if error is not None:
+            if error.resp.status == 304:
+                print "No changes."
+                return 0
+            if error.resp.status != 410:
+                raise error
+            print "Sync token expired, fetching all events again."
+            store.forget_sync_token()
+            return self.sync_full(calendar_id, window)
+        pager = self.list_events(request, response)
+        deleted_ids = []
+        changed = []
+        for item in pager:
+            if item.get("status") == "cancelled":
+                deleted_ids.append(item["id"])
+            else:
+                changed.append(item)
+        events = self.get_simple_events(changed)
+        changes = store.apply_changes(events, deleted_ids, pager.sync_token, pager.etag)
+        print "Synced {} changed events.".format(changes)
+        return changes
+    
+    def sync_full(self, calendar_id, days):
+        return self.apply_full_sync(calendar_id, days, self.window_request(calendar_id, days), None, None)
+    
+    def list_request(self, calendar_id, etag=None, **kwargs):
+        """ With an etag the request is conditional and fails
+        with an HttpError 304 if nothing changed. """
+        request = self.calendar_service.events().list(calendarId=calendar_id, singleEvents=True,
+                                                      fields=EVENT_LIST_FIELDS, maxResults=PAGE_SIZE, **kwargs)
+        if etag:
+            request.headers["If-None-Match"] = etag
+        return request
+    
+    def window_request(self, calendar_id, days):
+        return self.list_request(calendar_id, timeMin=self.format_rfc3339(day_start(days[0])),
+                                 timeMax=self.format_rfc3339(day_end(days[-1])))
+    
+    def list_events(self, request, response=None):
+        """ Returns an EventPager that streams the items of all pages,
+        starting with response, the answer to request if already sent. """
+        return EventPager(self.calendar_service.events(), request, response)
+    
+    def format_rfc3339(self, seconds):
+        return datetime.utcfromtimestamp(seconds).isoformat() + "Z"
+    
+    def get_cache_path(self, calendar_id):
+        """ Every calendar has its own cache file. """
+        name = "event_cache_" + hashlib.md5(calendar_id.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.script_dir, name)
+    
+    def load_cache(self, calendar_id):
+        """ Reads the days of the window from the event cache of a calendar. """
+        store = EventStore()
+        path = self.get_cache_path(calendar_id)
+        if not os.path.isfile(path):
+            return store
+        window = self.get_window()
+        try:
+            with phase("read cache"):
+                reader = EventCacheReader(path)
+                try:
+                    events = reader.read_events(window[0], window[-1])
+                finally:
+                    reader.close()
+        except EventCacheError as e:
+            print "Error while reading file {}: {}".format(path, e)
+            return store
+        days = [day for day in window if day in reader.days]
+        store.reset(events, reader.sync_token, days)
+        self.cached_states[calendar_id] = self.get_cache_state(store.snapshot)
+        self.synced_at = min(self.synced_at or reader.written_at, reader.written_at)
+        print "Successfully read events from cache."
+        return store
+    
+    def get_cache_state(self, snapshot):
+        return snapshot.version, snapshot.sync_token, snapshot.days
+    
+    def update_cache(self, calendar_id):
+        """ Writes the store of a calendar to its cache file unless
+        the file already has this state, e.g. after an unchanged poll. """
+        snapshot = self.get_store(calendar_id).snapshot
+        state = self.get_cache_state(snapshot)
+        if self.cached_states.get(calendar_id) == state:
+            return True
+        path = self.get_cache_path(calendar_id)
+        try:
+            with CacheLock(os.path.join(self.script_dir, CACHE_LOCK_FILE), CACHE_LOCK_TIMEOUT):
+                write_cache(path, snapshot.sync_token, snapshot.days, snapshot.ordered)
+        except EnvironmentError:
             print "Could not write to file %s." % path
             return False
+        self.cached_states[calendar_id] = state
         print "Successfully updated event cache."
+        return True
     
     def get_current_situation(self):
-        events = self.get_simple_events(self.get_events_today())
-        if len(events) < 1:
-            return Situation(None, None, None)
-        events = self.sort_events(events)
-        now = time.time()
-        if events[0].start > now:
-            return Situation(None, None, events[0])
-        if events[-1].end < now:
-            return Situation(events[-1], None, None)
-        if len(events) == 1:
-            if events[0].end < now:
-                return Situation(events[0], None, None)
-            return Situation(None, events[0], None)
-        if events[0].start < now and events[0].end > now:
-            return Situation(None, events[0], events[1])
-        if events[-1].start < now and events[-1].end > now:
-            return Situation(events[-2], events[-1], None)
-        for i in xrange(1, len(events)):
-            if events[i].start > now:
-                return Situation(events[i-1], None, events[i])
-            if events[i].end > now:
-                return Situation(events[i-1], events[i], events[i+1])
-        print "Could not get current situation."
-        return Situation(None, None, None)
+        return self.situation_at(time.time())
     
-    def get_simple_events(self, events):
-        return [SimpleEvent().from_google_event(event) for event in events]
-    
-    def sort_events(self, events):
-        changed = True
-        while changed:
-            changed = False
-            for i in xrange(len(events) -1):
-                if events[i].start > events[i+1].start:
-                    changed = True
-                    temp = events[i+1]
-                    events[i+1] = events[i]
-                    events[i] = temp
-        return events
-
-class Situation():
-    """ Represents the current situation with last, current and next event. """
-    def __init__(self, last=None, current=None, next_=None):
-        self.last = last
-        self.current = current
-        self.next = next_
-    
-    def is_freetime(self):
-        return not self.current and not self.next
-    
-    def relative_position_available(self):
-        return self.current or (self.last and self.next)
-    
-    def get_current_length(self):
-        if self.current:
-            return self.current.end - self.current.start
-        if self.last and self.next:
-            return self.next.start - self.last.end
-        return 0
+    def get_cached_situation(self):
+        """ Returns the current situation of the events in the local cache
+        without authenticating or fetching anything. """
+        return self.get_event_index(fetch=False).situation_at(time.time())
     
-    def has_last_break(self):
-        return self.last and self.current
+    def get_next_transition(self, ts):
+        """ Returns when the situation changes next after ts according
+        to the events known locally, None if it does not change anymore. """
+        return self.get_event_index(fetch=False).next_transition(ts)
     
-    def has_next_break(self):
-        return self.current and self.next
+    def situation_at(self, ts):
+        """ Returns the Situation at the timestamp ts using the event index. """
+        return self.get_event_index().situation_at(ts)
     
-    def get_last_break_length(self):
-        return self.current.start - self.last.end
+    def get_event_index(self, fetch=True):
+        """ Returns the interval index of the events in the window.
+        It is only rebuilt if the set of events changed. """
+        if fetch:
+            self.ensure_window()
+        window = self.get_window()
+        stores = self.get_stores()
+        snapshots = [store.snapshot for store in stores]
+        key = (window[0], tuple(id(store) for store in stores), tuple(snapshot.version for snapshot in snapshots))
+        indexed = self.event_index
+        if indexed is None or key != indexed[0]:
+            with phase("build index"):
+                indexed = (key, EventIndex(self.merge_snapshots(snapshots, window[0], window[-1])))
+            self.event_index = indexed
+        return indexed[1]
     
-    def get_next_break_length(self):
-        return self.next.start - self.current.end
-
-class SimpleEvent():
-    """ Represents an event with title, start, end, description and location. """
-    def __init__(self, title="", start=0, end=0, description="", location="", google_id=""):
-        self.title = title
-        self.description = description
-        self.start = start
-        self.end = end
-        self.location = location
-        self.google_id = google_id
-    
-    def from_google_event(self, event):
-        self.title = event["summary"]
-        self.start = self.convert_isodate_to_seconds(event["start"]["dateTime"], ignore_tz=True)
-        self.end = self.convert_isodate_to_seconds(event["end"]["dateTime"], ignore_tz=True)
-        self.description = event.get("description", "")
-        self.location = event.get("location", "")
-        self.google_id = event["id"]
-        return self
-    
-    def convert_isodate_to_seconds(self, ts, ignore_tz=False):
-        """Takes ISO 8601 format(string) and converts into epoch time."""
-        if ignore_tz:
-            dt = datetime.strptime(ts[:-7],'%Y-%m-%dT%H:%M:%S')
-        else:
-            dt = datetime.strptime(ts[:-7],'%Y-%m-%dT%H:%M:%S')+\
-                        timedelta(hours=int(ts[-5:-3]),
-                        minutes=int(ts[-2:]))*int(ts[-6:-5]+'1')
-        seconds = time.mktime(dt.timetuple())# + dt.microsecond/1000000.0
-        return seconds
-    
-    def __repr__(self):
-        return "{} - {}: {}".format(datetime.fromtimestamp(self.start), datetime.fromtimestamp(self.end), self.title)
+    def get_simple_events(self, events):
+        """ Skips malformed events, one of them must not stop the whole calendar
+        from syncing as the same sync token would return it again. """
+        simple_events = []
+        for event in events:
+            try:
+                simple_events.append(SimpleEvent().from_google_event(event))
+            except (KeyError, TypeError, ValueError) as e:
+                print "Skipped malformed event {}: {!r}".format(event.get("id"), e)
+        return simple_events
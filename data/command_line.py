@@ -0,0 +1,27 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+import sys
+
+def pop_option(name, takes_value=False, default=None):
+    """ Removes an option of Scholaris from sys.argv before Kivy parses it
+    (Kivy exits on options it does not know). Returns the value of the
+    option, True for a flag without value, or default if it is missing. """
+    argv = sys.argv
+    for i, argument in enumerate(argv[1:], 1):
+        if argument == name:
+            if not takes_value:
+                del argv[i]
+                return True
+            if i + 1 < len(argv):
+                value = argv[i + 1]
+                del argv[i:i + 2]
+                return value
+            del argv[i]
+            return default
+        if takes_value and argument.startswith(name + "="):
+            del argv[i]
+            return argument[len(name) + 1:]
+    return default
@@ -3,15 +3,102 @@
 #
 # Copyright Tim Henning 2014
 
-from kivy.animation import Animation
+from data.power import SMOOTH, STEP, PAUSED, DECORATION_STEP
 from kivy.clock import Clock
+from kivy.graphics import Color, Mesh
 from kivy.lang import Builder
+from kivy.metrics import dp
 from kivy.properties import NumericProperty, ObjectProperty
 from kivy.uix.widget import Widget
+import math
 import random
 
+# an arc of a mesh decoration is made of straight pieces of at most this angle
+ARC_SEGMENT_ANGLE = 5
 
-class MovingDecoration(Widget):
+
+def cycle_phase(now, start, period):
+    """ Position in [0, 1) within the current cycle of a periodic movement. """
+    return ((now - start) / period) % 1.0
+
+def ramp(elapsed, duration, begin=0.0):
+    """ Linear movement from begin to 1 that stops at 1 after duration. """
+    return begin + (1.0 - begin) * min(elapsed / duration, 1.0)
+
+class DecorationAnimator():
+    """ Moves all decorations that are on screen from a single frame callback.
+    Every decoration computes its elements from the frame time, so no
+    Animation objects and no timers per decoration are needed.
+    The mode (see data/power.py) makes them move every frame, in steps
+    of DECORATION_STEP seconds or stop. """
+    def __init__(self):
+        self.decorations = []
+        self.mode = SMOOTH
+
+    def register(self, decoration):
+        if decoration in self.decorations:
+            return
+        self.decorations.append(decoration)
+        if len(self.decorations) == 1:
+            self.reschedule()
+
+    def unregister(self, decoration):
+        if decoration not in self.decorations:
+            return
+        self.decorations.remove(decoration)
+        if not self.decorations:
+            self.reschedule()
+
+    def set_mode(self, mode):
+        if mode != self.mode:
+            self.mode = mode
+            self.reschedule()
+
+    def reschedule(self):
+        Clock.unschedule(self.update)
+        if not self.decorations or self.mode == PAUSED:
+            return
+        Clock.schedule_interval(self.update, DECORATION_STEP if self.mode == STEP else 0)
+
+    def update(self, dt):
+        now = Clock.get_time()
+        for decoration in self.decorations:
+            decoration.update_phases(now)
+
+animator = DecorationAnimator()
+
+class AnimatedDecoration(Widget):
+    """ Base class for decorations that are moved by the animator. It is
+    registered while it is part of a tree with a window and unregistered
+    as soon as it or one of its ancestors is removed from it. """
+    def __init__(self, **kwargs):
+        self.watched = []  # the decoration and its ancestors
+        super(AnimatedDecoration, self).__init__(**kwargs)
+        self.start_time = Clock.get_time()
+        self.watch_tree()
+
+    def on_tree_changed(self, *args):
+        self.watch_tree()
+
+    def watch_tree(self):
+        for widget in self.watched:
+            widget.unbind(parent=self.on_tree_changed)
+        self.watched = []
+        widget = self
+        while isinstance(widget, Widget):
+            widget.bind(parent=self.on_tree_changed)
+            self.watched.append(widget)
+            widget = widget.parent
+        if self.get_root_window() is not None:
+            self.update_phases(Clock.get_time())
+            animator.register(self)
+        else:
+            animator.unregister(self)
+
+    def update_phases(self, now):
+        pass
+
+class MovingDecoration(AnimatedDecoration):
     """ Base class for widgets with three periodical moving elements """
     direction_0 = NumericProperty(1)
     direction_1 = NumericProperty(1)
@@ -24,6 +111,7 @@ class MovingDecoration(Widget):
     color_2 = ObjectProperty((1, 1, 1, 0.9))
     
     def __init__(self, **kwargs):
+        self.speeds = [1.5 + random.random() * 4, 1.5 + random.random() * 4, 1.5 + random.random() * 4]
         super(MovingDecoration, self).__init__(**kwargs)
         self.segment_width_0 = 30 + random.random() * 100
         self.segment_width_1 = 30 + random.random() * 100
@@ -31,67 +119,173 @@ class MovingDecoration(Widget):
         self.direction_0 = 1 if random.random() < 0.5 else -1
         self.direction_1 = 1 if random.random() < 0.5 else -1
         self.direction_2 = 1 if random.random() < 0.5 else -1
-        self.speeds = [1.5 + random.random() * 4, 1.5 + random.random() * 4, 1.5 + random.random() * 4]
 
 class RotatingDecoration(MovingDecoration):
-    """ Base class for widgets with three rotating elements """
+    """ Base class for widgets with three rotating elements.
+    Element i turns once in speeds[i] seconds. """
     angle_0 = NumericProperty(0)
     angle_1 = NumericProperty(0)
     angle_2 = NumericProperty(0)
     
     def __init__(self, **kwargs):
-        super(RotatingDecoration, self).__init__(**kwargs)
         self.offsets = (0, random.random() * 360, random.random() * 360)
-        Clock.schedule_interval(self.start_animation_0, self.speeds[0])
-        Clock.schedule_interval(self.start_animation_1, self.speeds[1])
-        Clock.schedule_interval(self.start_animation_2, self.speeds[2])
-        
-    def start_animation_0(self, trigger=None, value=None):
-        self.angle_0 = self.offsets[0]
-        anim = Animation(angle_0=360+self.offsets[0], duration=self.speeds[0])
-        anim.start(self)
-    
-    def start_animation_1(self, trigger=None, value=None):
-        self.angle_1 = self.offsets[1]
-        anim = Animation(angle_1=360+self.offsets[1], duration=self.speeds[1])
-        anim.start(self)
-
-    def start_animation_2(self, trigger=None, value=None):
-        self.angle_2 = self.offsets[2]
-        anim = Animation(angle_2=360+self.offsets[2], duration=self.speeds[2])
-        anim.start(self)
+        super(RotatingDecoration, self).__init__(**kwargs)
+    
+    def get_angles(self, now):
+        start, speeds, offsets = self.start_time, self.speeds, self.offsets
+        return (offsets[0] + 360 * cycle_phase(now, start, speeds[0]),
+                offsets[1] + 360 * cycle_phase(now, start, speeds[1]),
+                offsets[2] + 360 * cycle_phase(now, start, speeds[2]))
+    
+    def update_phases(self, now):
+        self.angle_0, self.angle_1, self.angle_2 = self.get_angles(now)
+
+def arc_template(radius, width, span):
+    """ Returns the outline of an arc starting at angle 0 (the top) as list
+    of x, y pairs relative to the center, alternating inner and outer edge.
+    Angles are in degrees clockwise like those of Line(circle=...). """
+    points = []
+    segments = arc_segments(span)
+    for i in xrange(segments + 1):
+        angle = math.radians(span * i / float(segments))
+        sin, cos = math.sin(angle), math.cos(angle)
+        for edge_radius in (radius - width, radius + width):
+            points.append((edge_radius * sin, edge_radius * cos))
+    return points
+
+def arc_segments(span):
+    return max(2, int(math.ceil(abs(span) / float(ARC_SEGMENT_ANGLE))))
+
+def arc_indices(spans):
+    """ Triangles of arcs with these spans that follow each other in one mesh. """
+    indices = []
+    base = 0
+    for span in spans:
+        segments = arc_segments(span)
+        for i in xrange(base, base + segments * 2, 2):
+            indices.extend((i, i + 1, i + 2, i + 1, i + 3, i + 2))
+        base += (segments + 1) * 2
+    return indices
+
+class ArcDecoration(RotatingDecoration):
+    """ Base class for rotating decorations made of arcs. Instead of a kv rule
+    with a Line per arc, all arcs of one color are drawn by one Mesh. The outline
+    of every arc is computed when the size changes; each frame it is only
+    rotated into the preallocated vertex list of its mesh.
+
+    Subclasses return their arcs from get_arcs() as tuples (color index,
+    radius offset, line width, span, element, turn, start offset): the arc
+    starts at the angle of the element (None for a fixed arc) times turn plus
+    the start offset. get_colors() returns one color per color index. """
+    def __init__(self, **kwargs):
+        self.meshes = None
+        self.geometry_changed = True  # fixed arcs are only moved then
+        super(ArcDecoration, self).__init__(**kwargs)
+        self.build_meshes()
+        self.bind(pos=self.update_position, size=self.update_size,
+                  color_0=self.update_colors, color_1=self.update_colors, color_2=self.update_colors,
+                  segment_width_0=self.update_shape, segment_width_1=self.update_shape,
+                  segment_width_2=self.update_shape, direction_0=self.update_shape,
+                  direction_1=self.update_shape, direction_2=self.update_shape)
+    
+    def get_arcs(self):
+        return []
+    
+    def get_colors(self):
+        return []
+    
+    def build_meshes(self):
+        """ Creates a Color and a Mesh per color of the arcs. """
+        arcs = self.get_arcs()
+        self.canvas.clear()
+        self.meshes = []
+        with self.canvas:
+            for color_index, rgba in enumerate(self.get_colors()):
+                group = [arc for arc in arcs if arc[0] == color_index]
+                if not group:
+                    continue
+                vertices = [0.0] * sum((arc_segments(arc[3]) + 1) * 2 * 4 for arc in group)
+                color = Color(*rgba)
+                mesh = Mesh(vertices=vertices, indices=arc_indices([arc[3] for arc in group]), mode="triangles")
+                self.meshes.append((color_index, color, mesh, group, vertices, []))
+        self.update_templates()
+    
+    def update_templates(self):
+        self.geometry_changed = True
+        radius = self.width * 0.5
+        for color_index, color, mesh, group, vertices, templates in self.meshes:
+            del templates[:]
+            for arc in group:
+                templates.append(arc_template(radius + arc[1], arc[2], arc[3]))
+    
+    def update_shape(self, *args):
+        """ The arcs themselves changed, e.g. their span. """
+        self.build_meshes()
+        self.update_phases(Clock.get_time())
+    
+    def update_size(self, *args):
+        if self.meshes is None:
+            return
+        self.update_templates()
+        self.update_phases(Clock.get_time())
+    
+    def update_position(self, *args):
+        """ The outlines are relative to the center, only the vertices move. """
+        if self.meshes is None:
+            return
+        self.geometry_changed = True
+        self.update_phases(Clock.get_time())
+    
+    def update_colors(self, *args):
+        if self.meshes is None:
+            return
+        colors = self.get_colors()
+        for color_index, color, mesh, group, vertices, templates in self.meshes:
+            color.rgba = colors[color_index]
+    
+    def update_phases(self, now):
+        if self.meshes is None:
+            return
+        angles = self.get_angles(now)
+        center_x, center_y = self.center
+        for color_index, color, mesh, group, vertices, templates in self.meshes:
+            i = 0
+            for arc, template in zip(group, templates):
+                element, turn, offset = arc[4], arc[5], arc[6]
+                if element is None and not self.geometry_changed:
+                    i += len(template) * 4
+                    continue
+                start = math.radians((angles[element] if element is not None else 0) * turn + offset)
+                sin, cos = math.sin(start), math.cos(start)
+                # rotated clockwise by start, every vertex is x, y, u, v
+                end = i + len(template) * 4
+                vertices[i:end:4] = [center_x + x * cos + y * sin for x, y in template]
+                vertices[i + 1:end:4] = [center_y + y * cos - x * sin for x, y in template]
+                i = end
+            mesh.vertices = vertices
+        self.geometry_changed = False
 
 class LinearDecoration(MovingDecoration):
-    """ Base class for widgets with three linear moving elements """
+    """ Base class for widgets with three linear moving elements.
+    Element i crosses the widget once in speeds[i] seconds. """
     pos_0 = NumericProperty(0)
     pos_1 = NumericProperty(0)
     pos_2 = NumericProperty(0)
     
     def __init__(self, **kwargs):
-        super(LinearDecoration, self).__init__(**kwargs)
         self.offsets = (0, random.random(), random.random())
-        Clock.schedule_interval(self.start_animation_0, self.speeds[0])
-        Clock.schedule_interval(self.start_animation_1, self.speeds[1])
-        Clock.schedule_interval(self.start_animation_2, self.speeds[2])
-        
-    def start_animation_0(self, trigger=None, value=None):
-        self.pos_0 = self.offsets[0]
-        anim = Animation(pos_0=1+self.offsets[0], duration=self.speeds[0])
-        anim.start(self)
-    
-    def start_animation_1(self, trigger=None, value=None):
-        self.pos_1 = self.offsets[1]
-        anim = Animation(pos_1=1+self.offsets[1], duration=self.speeds[1])
-        anim.start(self)
-
-    def start_animation_2(self, trigger=None, value=None):
-        self.pos_2 = self.offsets[2]
-        anim = Animation(pos_2=1+self.offsets[2], duration=self.speeds[2])
-        anim.start(self)
-
-class PairValueDecoration(Widget):
+        super(LinearDecoration, self).__init__(**kwargs)
+    
+    def update_phases(self, now):
+        start, speeds, offsets = self.start_time, self.speeds, self.offsets
+        self.pos_0 = offsets[0] + cycle_phase(now, start, speeds[0])
+        self.pos_1 = offsets[1] + cycle_phase(now, start, speeds[1])
+        self.pos_2 = offsets[2] + cycle_phase(now, start, speeds[2])
+
+class PairValueDecoration(AnimatedDecoration):
     """ Base class for widgets with two linear moving lines.
-    The "pair" is start and end of a line. """
+    The "pair" is start and end of a line. In every cycle both ends
+    move to the right end with their own random speed. """
     pos0_0 = NumericProperty(0)
     pos0_1 = NumericProperty(0)
     pos1_0 = NumericProperty(0)
@@ -100,46 +294,70 @@ class PairValueDecoration(Widget):
     color_1 = ObjectProperty((1, 1, 1, 0.75))
     
     def __init__(self, **kwargs):
+        self.cycles = [None, None]
         super(PairValueDecoration, self).__init__(**kwargs)
-        self.start_animation_0()
-        self.start_animation_1()
-        
-    def start_animation_0(self, trigger=None, value=None):
-        self.pos0_0 = 0
-        self.pos0_1 = random.random() * -0.5
-        speed_0 = 2 + random.random() * 2
-        speed_1 = 2 + random.random() * 2
-        anim = Animation(pos0_0=1, duration=speed_0)
-        anim.start(self)
-        anim = Animation(pos0_1=1, duration=speed_1)
-        anim.start(self)
-        Clock.schedule_once(self.start_animation_0, max(speed_0, speed_1))
-    
-    def start_animation_1(self, trigger=None, value=None):
-        self.pos1_0 = 0
-        self.pos1_1 = random.random() * -0.5
-        speed_0 = 2 + random.random() * 2
-        speed_1 = 2 + random.random() * 2
-        anim = Animation(pos1_0=1, duration=speed_0)
-        anim.start(self)
-        anim = Animation(pos1_1=1, duration=speed_1)
-        anim.start(self)
-        Clock.schedule_once(self.start_animation_1, max(speed_0, speed_1))
-
-class CircleDecoration(RotatingDecoration):
-    pass
+    
+    def new_cycle(self, start):
+        """ Returns start, durations of both ends and where the second end begins. """
+        return (start, 2 + random.random() * 2, 2 + random.random() * 2, random.random() * -0.5)
+    
+    def current_cycle(self, line, now):
+        cycle = self.cycles[line]
+        if cycle is None:
+            cycle = self.new_cycle(now)
+        else:
+            start, duration_0, duration_1, begin_1 = cycle
+            end = start + max(duration_0, duration_1)
+            if now >= end:
+                # continue seamlessly, or start over after a pause
+                cycle = self.new_cycle(end if now - end < 1 else now)
+        self.cycles[line] = cycle
+        return cycle
+    
+    def update_phases(self, now):
+        start, duration_0, duration_1, begin_1 = self.current_cycle(0, now)
+        self.pos0_0 = ramp(now - start, duration_0)
+        self.pos0_1 = ramp(now - start, duration_1, begin_1)
+        start, duration_0, duration_1, begin_1 = self.current_cycle(1, now)
+        self.pos1_0 = ramp(now - start, duration_0)
+        self.pos1_1 = ramp(now - start, duration_1, begin_1)
 
-class GearDecoration(RotatingDecoration):
-    pass
+class CircleDecoration(ArcDecoration):
+    def get_arcs(self):
+        return [(0, dp(10), dp(3.5), self.segment_width_0, 0, self.direction_0, 0),
+                (1, dp(25), dp(3.5), self.segment_width_1, 1, self.direction_1, 0),
+                (2, dp(40), dp(3.5), self.segment_width_2, 2, self.direction_2, 0)]
+    
+    def get_colors(self):
+        return [self.color_0, self.color_1, self.color_2]
 
-class CrossDecoration(RotatingDecoration):
-    pass
+class GearDecoration(ArcDecoration):
+    def get_arcs(self):
+        return [(0, dp(10), 1.5, 360, None, 1, 0),
+                (0, dp(10), 3.5, self.segment_width_0 * 0.5, 0, 1, 0),
+                (0, dp(10), 3.5, self.segment_width_1 * 0.5, 1, -1, 0),
+                (0, dp(10), 3.5, self.segment_width_2 * 0.5, 2, 1, 0)]
+    
+    def get_colors(self):
+        return [(1, 1, 1, 0.8)]
+
+class CrossDecoration(ArcDecoration):
+    def get_arcs(self):
+        return [(0, dp(20), 1.5, 360, None, 1, 0)] + [(0, dp(10), 5, 10, 0, 1, offset) for offset in (0, 90, 180, 270)]
+    
+    def get_colors(self):
+        return [(1, 1, 1, 0.8)]
 
 class DotDecoration(RotatingDecoration):
     radius = NumericProperty(0)
 
-class RingDecoration(RotatingDecoration):
-    pass
+class RingDecoration(ArcDecoration):
+    def get_arcs(self):
+        return [(0, dp(7), 2, 300 * self.direction_0, 0, self.direction_0, 0),
+                (1, dp(15), 2, 300 * -self.direction_0, 1, -self.direction_0, 0)]
+    
+    def get_colors(self):
+        return [self.color_0, self.color_1]
 
 class LineDecoration(PairValueDecoration):
     pass
@@ -0,0 +1,201 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+""" Versioned binary file format for the event cache.
+
+Layout (little endian):
+    header          magic, version, flags, written_at, number of covered days,
+                    number of buckets, length of the sync token
+    sync token      utf-8
+    covered days    one date ordinal per fully fetched day
+    bucket table    per bucket: date ordinal, latest end, offset, event count
+    records         per event: start, end, four string lengths, the utf-8 strings
+                    title, description, location and google id
+
+Events are grouped into buckets by the local day they start on, so a
+reader can decode only the buckets that overlap the days it needs.
+Files are written to a temporary file and renamed into place. """
+
+from data.event_store import day_start, day_end
+from data.events import SimpleEvent
+from datetime import date, datetime
+import errno
+import mmap
+import os
+import struct
+import tempfile
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
+
+CACHE_MAGIC = "SCEC"
+CACHE_VERSION = 1
+
+HEADER = struct.Struct("<4sHHdIII")
+DAY = struct.Struct("<i")
+BUCKET = struct.Struct("<idII")
+RECORD = struct.Struct("<ddIIII")
+
+class EventCacheError(Exception):
+    """ The cache file is missing, damaged or of another version. """
+    pass
+
+def encode(text):
+    if isinstance(text, unicode):
+        return text.encode("utf-8")
+    return text
+
+def write_cache(path, sync_token, days, events):
+    """ Writes the events atomically to path. """
+    buckets = {}
+    for event in events:
+        buckets.setdefault(datetime.fromtimestamp(event.start).date().toordinal(), []).append(event)
+    ordinals = sorted(buckets)
+    token = encode(sync_token or "")
+    offset = HEADER.size + len(token) + DAY.size * len(days) + BUCKET.size * len(ordinals)
+    table = []
+    records = []
+    for ordinal in ordinals:
+        bucket = buckets[ordinal]
+        table.append(BUCKET.pack(ordinal, max(event.end for event in bucket), offset, len(bucket)))
+        for event in bucket:
+            fields = [encode(event.title), encode(event.description), encode(event.location), encode(event.google_id)]
+            record = RECORD.pack(event.start, event.end, *[len(field) for field in fields]) + "".join(fields)
+            records.append(record)
+            offset += len(record)
+    content = [HEADER.pack(CACHE_MAGIC, CACHE_VERSION, 0, time.time(), len(days), len(ordinals), len(token)), token]
+    content.extend(DAY.pack(day.toordinal()) for day in sorted(days))
+    content.extend(table)
+    content.extend(records)
+    directory = os.path.dirname(path) or "."
+    handle, temp_path = tempfile.mkstemp(prefix=".event_cache", dir=directory)
+    try:
+        with os.fdopen(handle, "wb") as file_object:
+            file_object.write("".join(content))
+            file_object.flush()
+            os.fsync(file_object.fileno())
+        if os.name == "nt" and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+class CacheLock():
+    """ Context manager that keeps several processes from writing the cache
+    at the same time with an fcntl lock on a separate file. If the lock file
+    cannot be opened (e.g. read only directory) or the lock is not free
+    within timeout seconds, the write happens without it: it is atomic
+    anyway, only the last writer wins. """
+    def __init__(self, path, timeout, delay=0.05):
+        self.path = path
+        self.timeout = timeout
+        self.delay = delay
+        self.file_object = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        try:
+            self.file_object = open(self.path, "a")
+        except EnvironmentError:
+            return self
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                fcntl.lockf(self.file_object.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return self
+            except EnvironmentError as e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN) or time.time() >= deadline:
+                    print "Could not lock {}, writing without the lock.".format(self.path)
+                    self.file_object.close()
+                    self.file_object = None
+                    return self
+            time.sleep(self.delay)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.file_object is not None:
+            fcntl.lockf(self.file_object.fileno(), fcntl.LOCK_UN)
+            self.file_object.close()
+            self.file_object = None
+        return False
+
+class EventCacheReader():
+    """ Maps a cache file into memory and decodes events on demand. """
+    def __init__(self, path):
+        try:
+            self.file_object = open(path, "rb")
+        except IOError as e:
+            raise EventCacheError(str(e))
+        try:
+            self.data = mmap.mmap(self.file_object.fileno(), 0, access=mmap.ACCESS_READ)
+            self.read_header()
+        except (ValueError, EnvironmentError, struct.error) as e:
+            self.close()
+            raise EventCacheError("Damaged event cache: {}".format(e))
+        except EventCacheError:
+            self.close()
+            raise
+
+    def read_header(self):
+        data = self.data
+        magic, version, flags, self.written_at, day_count, bucket_count, token_length = HEADER.unpack_from(data, 0)
+        if magic != CACHE_MAGIC:
+            raise EventCacheError("Not an event cache.")
+        if version != CACHE_VERSION:
+            raise EventCacheError("Event cache version {} is not supported.".format(version))
+        offset = HEADER.size
+        self.sync_token = data[offset:offset + token_length].decode("utf-8") or None
+        offset += token_length
+        self.days = set()
+        for i in xrange(day_count):
+            self.days.add(date.fromordinal(DAY.unpack_from(data, offset)[0]))
+            offset += DAY.size
+        self.buckets = []
+        for i in xrange(bucket_count):
+            self.buckets.append(BUCKET.unpack_from(data, offset))
+            offset += BUCKET.size
+        if offset > len(data):
+            raise EventCacheError("Truncated event cache.")
+
+    def read_events(self, first_day=None, last_day=None):
+        """ Decodes the events that overlap first_day to last_day (or all). """
+        start = day_start(first_day) if first_day else float("-inf")
+        end = day_end(last_day) if last_day else float("inf")
+        last_ordinal = last_day.toordinal() if last_day else float("inf")
+        events = []
+        try:
+            for ordinal, latest_end, offset, count in self.buckets:
+                if ordinal > last_ordinal or latest_end <= start:
+                    continue
+                for i in xrange(count):
+                    event, offset = self.read_record(offset)
+                    if event.end > start and event.start < end:
+                        events.append(event)
+        except (struct.error, UnicodeDecodeError) as e:
+            raise EventCacheError("Damaged event cache: {}".format(e))
+        return events
+
+    def read_record(self, offset):
+        data = self.data
+        start, end, title_length, description_length, location_length, id_length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        fields = []
+        for length in (title_length, description_length, location_length, id_length):
+            if offset + length > len(data):
+                raise EventCacheError("Truncated event cache.")
+            fields.append(data[offset:offset + length].decode("utf-8"))
+            offset += length
+        title, description, location, google_id = fields
+        return SimpleEvent(title, start, end, description, location, google_id), offset
+
+    def close(self):
+        if getattr(self, "data", None) is not None:
+            self.data.close()
+            self.data = None
+        self.file_object.close()
@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+from bisect import bisect_right
+from data.events import Situation
+import heapq
+
+def event_sort_key(event):
+    return (event.start, event.end, event.google_id)
+
+def sort_events(events):
+    """ Orders the events by start, end and id in place. """
+    events.sort(key=event_sort_key)
+    return events
+
+def merge_events(event_lists):
+    """ Merges lists of events that are each in (start, end, id) order
+    into one ordered list with a heap based k-way merge in O(n log k). """
+    decorated = [_decorate(events, i) for i, events in enumerate(event_lists)]
+    return [item[-1] for item in heapq.merge(*decorated)]
+
+def _decorate(events, position):
+    for event in events:
+        yield (event.start, event.end, event.google_id, position, event)
+
+class EventIndex():
+    """ Interval index over a set of events that answers
+    "last, current and next event at time ts" in O(log n).
+
+    The time line is cut at every event start and end into elementary
+    segments. Inside a segment the situation can not change, so the
+    situation of every segment is computed once with a sweep over
+    the events and looked up later with a binary search.
+    Overlapping events are allowed:
+    - current is the running event that started last
+    - last is the event that ended most recently
+    - next is the first event that starts after ts """
+    def __init__(self, events):
+        """ events have to be sorted by start """
+        self.events = events
+        self.boundaries = []
+        self.situations = []
+        self.build()
+
+    def build(self):
+        events = self.events
+        if not events:
+            self.first_situation = Situation(None, None, None)
+            return
+        starts = [event.start for event in events]
+        by_end = sorted(events, key=lambda event: (event.end, event.start))
+        boundaries = sorted(set(starts) | set(event.end for event in events))
+        active = []  # heap of (-start, end, position) of running events
+        last = None
+        next_start = 0  # position of the first event not started yet
+        next_end = 0  # position of the first event in by_end not ended yet
+        for boundary in boundaries:
+            while next_start < len(events) and starts[next_start] <= boundary:
+                event = events[next_start]
+                heapq.heappush(active, (-event.start, event.end, next_start))
+                next_start += 1
+            while next_end < len(by_end) and by_end[next_end].end <= boundary:
+                last = by_end[next_end]
+                next_end += 1
+            while active and active[0][1] <= boundary:
+                heapq.heappop(active)
+            current = events[active[0][2]] if active else None
+            next_ = events[next_start] if next_start < len(events) else None
+            self.situations.append(Situation(last, current, next_))
+        self.boundaries = boundaries
+        self.first_situation = Situation(None, None, events[0])
+
+    def situation_at(self, ts):
+        """ Returns the Situation at the timestamp ts (seconds since epoch). """
+        i = bisect_right(self.boundaries, ts) - 1
+        if i < 0:
+            return self.first_situation
+        return self.situations[i]
+
+    def next_transition(self, ts):
+        """ Returns the timestamp of the next change of the situation
+        after ts or None if the situation will not change anymore. """
+        i = bisect_right(self.boundaries, ts)
+        if i < len(self.boundaries):
+            return self.boundaries[i]
+        return None
+
+    def __len__(self):
+        return len(self.events)
@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+""" Streams the items of an events().list call page by page, following
+nextPageToken with the generated list_next method. While the items of
+one page are processed, the next page is already fetched in the
+background, and at most PREFETCH_PAGES pages wait in memory. """
+
+import Queue
+import threading
+
+PAGE_SIZE = 250
+PREFETCH_PAGES = 1
+
+class EventPager():
+    """ Iterating yields the items of all pages. Afterwards sync_token is the
+    nextSyncToken of the last page and etag the etag of the first one.
+    The Http object of the requests is only used by one thread at a time,
+    as long as the caller does not send other requests while iterating. """
+    def __init__(self, collection, request, response=None, prefetch=PREFETCH_PAGES):
+        self.collection = collection  # the events() resource, for list_next
+        self.request = request
+        self.response = response  # the answer to request if it was already sent
+        self.prefetch = prefetch
+        self.sync_token = None
+        self.etag = None
+        self.pages = 0
+
+    def __iter__(self):
+        for response in self.iter_pages():
+            self.pages += 1
+            if self.etag is None:
+                self.etag = response.get("etag")
+            self.sync_token = response.get("nextSyncToken")
+            for item in response.get("items", []):
+                yield item
+
+    def iter_pages(self):
+        if self.prefetch:
+            return self.prefetched_pages()
+        return self.fetch_pages(self.request, self.response)
+
+    def fetch_pages(self, request, response=None):
+        while request is not None:
+            if response is None:
+                response = request.execute()
+            yield response
+            request = self.collection.list_next(request, response)
+            response = None
+
+    def prefetched_pages(self):
+        response = self.response
+        if response is None:
+            response = self.request.execute()
+        next_request = self.collection.list_next(self.request, response)
+        if next_request is None:
+            # a single page needs no thread
+            yield response
+            return
+        queue = Queue.Queue(maxsize=self.prefetch)
+        stopped = threading.Event()
+        def put(entry):
+            while not stopped.is_set():
+                try:
+                    queue.put(entry, timeout=1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+        def produce():
+            try:
+                for page in self.fetch_pages(next_request):
+                    if not put((page, None)):
+                        return
+            except Exception as e:
+                put((None, e))
+                return
+            put((None, None))
+        thread = threading.Thread(target=produce)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield response
+            while True:
+                page, error = queue.get()
+                if error is not None:
+                    raise error
+                if page is None:
+                    return
+                yield page
+        finally:
+            # lets the thread end if the caller stopped iterating early
+            stopped.set()
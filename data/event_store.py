@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+from data.event_index import sort_events
+from datetime import datetime, timedelta
+import bisect
+import threading
+import time
+
+def day_start(day):
+    """ Returns the local midnight of day in seconds since epoch. """
+    return time.mktime(datetime(year=day.year, month=day.month, day=day.day).timetuple())
+
+def day_end(day):
+    return day_start(day + timedelta(days=1))
+
+class EventSnapshot():
+    """ Content of an event store at one point in time. It is never changed
+    after it was created, so it can be read without locks. """
+    def __init__(self, events, sync_token, etag, days, version, previous=None):
+        self.events = events  # dict by Google id, must not be changed
+        self.sync_token = sync_token
+        self.etag = etag  # of the last incremental fetch, for conditional requests
+        self.days = frozenset(days)  # days whose events were fetched completely
+        self.version = version  # increased on every change of the event set
+        if previous is not None and previous.events is events:
+            # same events, the order can be shared
+            self.ordered, self.starts = previous.ordered, previous.starts
+        else:
+            self.ordered = sort_events(events.values())
+            self.starts = [event.start for event in self.ordered]
+
+    def missing_days(self, days):
+        return [day for day in days if day not in self.days]
+
+    def events_between(self, start, end):
+        """ Returns the events that overlap [start, end) ordered by start. """
+        stop = bisect.bisect_left(self.starts, end)
+        return [event for event in self.ordered[:stop] if event.end > start]
+
+class EventStore():
+    """ Local copy of the events of a calendar, keyed by their Google id.
+    Together with the sync token of the last fetch it allows to apply
+    only the changes the Calendar API reports since then.
+
+    Changes are copy-on-write: a writer builds a new EventSnapshot and
+    replaces the current one in a single assignment, so readers take
+    store.snapshot once and get a consistent view without locking. """
+    def __init__(self):
+        self.snapshot = EventSnapshot({}, None, None, (), 0)
+        self.write_lock = threading.Lock()
+
+    def reset(self, events, sync_token, days):
+        """ Replaces the content with the result of a full fetch of days. """
+        with self.write_lock:
+            current = self.snapshot
+            self.snapshot = EventSnapshot(dict((event.google_id, event) for event in events),
+                                          sync_token, None, days, current.version + 1)
+
+    def add_days(self, events, days):
+        """ Merges the result of a fetch of additional days. """
+        with self.write_lock:
+            current = self.snapshot
+            merged = dict(current.events)
+            for event in events:
+                merged[event.google_id] = event
+            self.snapshot = EventSnapshot(merged, current.sync_token, current.etag,
+                                          current.days.union(days), current.version + 1)
+
+    def apply_changes(self, events, deleted_ids, sync_token, etag=None):
+        """ Merges the result of an incremental fetch.
+        Returns the number of changed events. """
+        with self.write_lock:
+            current = self.snapshot
+            changes = len(events) + len(deleted_ids)
+            merged = current.events
+            if changes:
+                merged = dict(merged)
+                for event in events:
+                    merged[event.google_id] = event
+                for google_id in deleted_ids:
+                    merged.pop(google_id, None)
+            self.snapshot = EventSnapshot(merged, sync_token, etag, current.days,
+                                          current.version + (1 if changes else 0), current)
+        return changes
+
+    def forget_sync_token(self):
+        """ Makes the next sync fetch everything, e.g. after the token expired. """
+        with self.write_lock:
+            current = self.snapshot
+            self.snapshot = EventSnapshot(current.events, None, None, current.days,
+                                          current.version, current)
+
+    def prune(self, first_day):
+        """ Forgets events that ended before first_day. """
+        limit = day_start(first_day)
+        with self.write_lock:
+            current = self.snapshot
+            kept = dict((google_id, event) for google_id, event in current.events.iteritems()
+                        if event.end > limit)
+            days = [day for day in current.days if day >= first_day]
+            if len(kept) == len(current.events) and len(days) == len(current.days):
+                return
+            version = current.version + (1 if len(kept) != len(current.events) else 0)
+            self.snapshot = EventSnapshot(kept, current.sync_token, current.etag, days, version)
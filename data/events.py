@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+from data.isodate import parse_event_time
+from datetime import datetime
+
+class Situation():
+    """ Represents the current situation with last, current and next event. """
+    def __init__(self, last=None, current=None, next_=None):
+        self.last = last
+        self.current = current
+        self.next = next_
+    
+    def is_freetime(self):
+        return not self.current and not self.next
+    
+    def relative_position_available(self):
+        return self.current or (self.last and self.next)
+    
+    def get_current_length(self):
+        if self.current:
+            return self.current.duration
+        if self.last and self.next:
+            return self.next.start - self.last.end
+        return 0
+    
+    def has_last_break(self):
+        return self.last and self.current
+    
+    def has_next_break(self):
+        return self.current and self.next
+    
+    def get_last_break_length(self):
+        return self.current.start - self.last.end
+    
+    def get_next_break_length(self):
+        return self.next.start - self.current.end
+
+def format_clock_time(seconds):
+    """ Formats seconds since epoch as local time like 9:05. """
+    time_to_format = datetime.fromtimestamp(seconds)
+    return "{:d}:{:02d}".format(time_to_format.hour, time_to_format.minute)
+
+class SimpleEvent(object):
+    """ Represents an event with title, start, end, description and location.
+    Uses slots to stay small in large event sets and computes the
+    formatted local start and end time only once. """
+    __slots__ = ("title", "description", "start", "end", "location", "google_id",
+                 "duration", "_start_time", "_end_time")
+    
+    def __init__(self, title="", start=0, end=0, description="", location="", google_id=""):
+        self.title = title
+        self.description = description
+        self.location = location
+        self.google_id = google_id
+        self.set_times(start, end)
+    
+    def set_times(self, start, end):
+        self.start = start
+        self.end = end
+        self.duration = end - start
+        self._start_time = None
+        self._end_time = None
+    
+    @property
+    def start_time(self):
+        """ Local start time as H:MM """
+        if self._start_time is None:
+            self._start_time = format_clock_time(self.start)
+        return self._start_time
+    
+    @property
+    def end_time(self):
+        """ Local end time as H:MM """
+        if self._end_time is None:
+            self._end_time = format_clock_time(self.end)
+        return self._end_time
+    
+    def from_google_event(self, event):
+        self.title = event.get("summary", "")  # missing for untitled events
+        self.set_times(parse_event_time(event["start"]), parse_event_time(event["end"]))
+        self.description = event.get("description", "")
+        self.location = event.get("location", "")
+        self.google_id = event["id"]
+        return self
+    
+    def __repr__(self):
+        return "{} - {}: {}".format(datetime.fromtimestamp(self.start), datetime.fromtimestamp(self.end), self.title)
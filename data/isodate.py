@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+""" Fast parsing of the RFC 3339 timestamps used by the Calendar API,
+e.g. "2014-05-12T10:15:00+02:00", "2014-05-12T08:15:00.250Z"
+and "2014-05-12" for all-day events. """
+
+import time
+
+_day_seconds_cache = {}
+_local_midnight_cache = {}
+
+def days_from_civil(year, month, day):
+    """ Days since 1970-01-01 of a date in the proleptic Gregorian calendar. """
+    if month <= 2:
+        year -= 1
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+def _utc_day_seconds(date_string):
+    seconds = _day_seconds_cache.get(date_string)
+    if seconds is None:
+        if len(date_string) != 10 or date_string[4] != "-" or date_string[7] != "-":
+            raise ValueError("Invalid date: {}".format(date_string))
+        seconds = 86400 * days_from_civil(int(date_string[0:4]), int(date_string[5:7]), int(date_string[8:10]))
+        _day_seconds_cache[date_string] = seconds
+    return seconds
+
+def parse_datetime(ts):
+    """ Converts an RFC 3339 date-time into seconds since epoch (UTC).
+    The offset ("Z" or +-HH:MM) is honored and fractional seconds are kept. """
+    if len(ts) < 20 or ts[10] not in "Tt " or ts[13] != ":" or ts[16] != ":":
+        raise ValueError("Invalid RFC 3339 date-time: {}".format(ts))
+    seconds = (_utc_day_seconds(ts[:10]) + int(ts[11:13]) * 3600
+               + int(ts[14:16]) * 60 + int(ts[17:19]))
+    i = 19
+    if ts[i] == ".":
+        i += 1
+        while i < len(ts) and ts[i].isdigit():
+            i += 1
+        seconds += float(ts[19:i])
+    zone = ts[i:]
+    if zone in ("Z", "z"):
+        return seconds
+    if len(zone) != 6 or zone[0] not in "+-" or zone[3] != ":":
+        raise ValueError("Invalid RFC 3339 offset: {}".format(ts))
+    offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+    if zone[0] == "+":
+        return seconds - offset
+    return seconds + offset
+
+def parse_date(date_string):
+    """ Converts an all-day date like "2014-05-12" into
+    the seconds since epoch of its local midnight. """
+    seconds = _local_midnight_cache.get(date_string)
+    if seconds is None:
+        _utc_day_seconds(date_string)  # validates the format
+        seconds = time.mktime((int(date_string[0:4]), int(date_string[5:7]),
+                               int(date_string[8:10]), 0, 0, 0, 0, 0, -1))
+        _local_midnight_cache[date_string] = seconds
+    return seconds
+
+def parse_event_time(event_time):
+    """ Converts the start or end of a Google event, which has either
+    a "dateTime" or (for all-day events) a "date" field. """
+    if "dateTime" in event_time:
+        return parse_datetime(event_time["dateTime"])
+    return parse_date(event_time["date"])
@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+""" Power profiles for displays that run around the clock. A profile caps
+the frame rate, decides how the decorations move during and outside the
+active hours (see data/scheduler.py) and how often the progress marker
+of the current card moves, so that in the low profiles only the
+countdown label changes between two seconds and Kivy has nothing
+else to redraw. """
+
+from data.scheduler import is_quiet_time
+import os
+import time
+
+# how decorations move: every frame, once per DECORATION_STEP seconds or not at all
+SMOOTH = "smooth"
+STEP = "step"
+PAUSED = "paused"
+DECORATION_STEP = 1.0
+
+class PowerProfile():
+    def __init__(self, name, max_fps, decorations, quiet_decorations, marker_step):
+        self.name = name
+        self.max_fps = max_fps
+        self.decorations = decorations  # during the active hours
+        self.quiet_decorations = quiet_decorations  # at night and on weekends
+        self.marker_step = marker_step  # the marker only moves by at least this fraction
+
+    def get_decoration_mode(self, now):
+        if is_quiet_time(now):
+            return self.quiet_decorations
+        return self.decorations
+
+POWER_PROFILES = {
+    "normal": PowerProfile("normal", 60, SMOOTH, SMOOTH, 0),
+    "low": PowerProfile("low", 20, SMOOTH, STEP, 0.005),
+    "minimal": PowerProfile("minimal", 10, STEP, PAUSED, 0.02),
+}
+DEFAULT_POWER_PROFILE = "normal"
+
+def get_power_profile(name):
+    if name not in POWER_PROFILES:
+        print "Unknown power profile {}, using {}.".format(name, DEFAULT_POWER_PROFILE)
+        name = DEFAULT_POWER_PROFILE
+    return POWER_PROFILES[name]
+
+class UsageMonitor():
+    """ Measures the CPU time the process used per second between two samples. """
+    def __init__(self):
+        self.last_sample = None
+
+    def sample(self):
+        """ Returns the CPU usage since the last sample (1.0 is one core), None on the first call. """
+        times = os.times()
+        cpu, now = times[0] + times[1], time.time()
+        last_sample, self.last_sample = self.last_sample, (cpu, now)
+        if last_sample is None or now <= last_sample[1]:
+            return None
+        return (cpu - last_sample[0]) / (now - last_sample[1])
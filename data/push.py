@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+""" Opt-in push mode: instead of fetching again and again, a watch channel is
+registered for every displayed calendar and Google notifies a small built-in
+HTTP receiver when the events changed.
+
+The webhook address has to be a public HTTPS URL (e.g. a reverse proxy)
+that forwards the notifications to PUSH_RECEIVER_PORT on this machine. """
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from data.wall_server import ThreadingHTTPServer
+from googleapiclient.channel import new_webhook_channel, notification_from_headers
+from googleapiclient.errors import InvalidNotificationError
+import datetime
+import threading
+import time
+import uuid
+
+PUSH_RECEIVER_PORT = 8766
+# lifetime requested for a channel and how long before its
+# expiration it is replaced by a new one (seconds)
+CHANNEL_LIFETIME = 24 * 3600
+CHANNEL_RENEW_MARGIN = 3600
+
+class PushReceiver():
+    """ Keeps one watch channel per calendar alive and calls
+    on_change(calendar_id) when a notification reports a change. """
+    def __init__(self, backend, webhook_url, on_change, port=PUSH_RECEIVER_PORT):
+        self.backend = backend
+        self.webhook_url = webhook_url
+        self.on_change = on_change
+        self.port = port
+        self.lock = threading.Lock()
+        self.channels = {}  # channel id -> (calendar id, Channel)
+        self.message_numbers = {}  # channel id -> last message number
+        self.wake_event = threading.Event()
+        self.httpd = None
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer(("", self.port), PushRequestHandler)
+        self.httpd.receiver = self
+        for target in (self.httpd.serve_forever, self.run_renewals):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        print "Receiving push notifications on port {}.".format(self.port)
+
+    def watch(self, calendar_id):
+        """ Registers a new channel for the events of a calendar. """
+        expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=CHANNEL_LIFETIME)
+        channel = new_webhook_channel(self.webhook_url, token=str(uuid.uuid4()), expiration=expiration)
+        with self.backend.sync_lock:
+            response = self.backend.calendar_service.events().watch(
+                calendarId=calendar_id, body=channel.body()).execute()
+        channel.update(response)
+        channel.expiration = int(channel.expiration)
+        with self.lock:
+            self.channels[channel.id] = (calendar_id, channel)
+        print "Watching calendar {} until {}.".format(
+            calendar_id, time.ctime(channel.expiration / 1000.0))
+        return channel
+
+    def stop(self, channel):
+        with self.lock:
+            self.channels.pop(channel.id, None)
+            self.message_numbers.pop(channel.id, None)
+        try:
+            with self.backend.sync_lock:
+                self.backend.calendar_service.channels().stop(body=channel.body()).execute()
+        except Exception as e:
+            print e
+
+    def renew(self):
+        """ Watches calendars without channel, stops the channels of calendars
+        that are not displayed anymore and replaces channels that expire soon.
+        Returns the time of the next renewal. """
+        limit = (time.time() + CHANNEL_RENEW_MARGIN) * 1000
+        with self.lock:
+            channels = self.channels.values()
+        calendar_ids = self.backend.get_calendar_ids()
+        watched = set()
+        for calendar_id, channel in channels:
+            if calendar_id not in calendar_ids:
+                self.stop(channel)
+                continue
+            if channel.expiration <= limit:
+                self.watch(calendar_id)
+                self.stop(channel)
+            watched.add(calendar_id)
+        for calendar_id in calendar_ids:
+            if calendar_id not in watched:
+                self.watch(calendar_id)
+        with self.lock:
+            expirations = [channel.expiration for calendar_id, channel in self.channels.values()]
+        if not expirations:
+            return time.time() + CHANNEL_RENEW_MARGIN
+        return min(expirations) / 1000.0 - CHANNEL_RENEW_MARGIN
+
+    def run_renewals(self):
+        while True:
+            if not self.backend.calendar_service:
+                self.backend.refresh()  # authenticates
+            try:
+                next_renewal = self.renew()
+            except Exception as e:
+                print "Could not register watch channel: {}".format(e)
+                next_renewal = time.time() + 60
+            # woken up early when the displayed calendars change (see set_calendar_id)
+            self.wake_event.wait(max(next_renewal - time.time(), 1))
+            self.wake_event.clear()
+
+    def handle_notification(self, headers):
+        """ Returns the HTTP status for the notification,
+        headers is a dict with upper case header names. """
+        channel_id = headers.get("X-GOOG-CHANNEL-ID")
+        with self.lock:
+            calendar_id, channel = self.channels.get(channel_id, (None, None))
+        if channel is None:
+            # an old channel, Google stops sending when it gets an error
+            return 404
+        if headers.get("X-GOOG-CHANNEL-TOKEN") != channel.token:
+            return 403
+        try:
+            notification = notification_from_headers(channel, headers)
+        except (InvalidNotificationError, KeyError, ValueError):
+            return 400
+        with self.lock:
+            if notification.message_number <= self.message_numbers.get(channel_id, -1):
+                return 200  # duplicate
+            self.message_numbers[channel_id] = notification.message_number
+        if calendar_id not in self.backend.get_calendar_ids():
+            # the channel of a calendar that was replaced, stopped by the next renewal
+            self.wake_event.set()
+            return 200
+        if notification.state != "sync":
+            # "sync" only confirms a new channel
+            self.on_change(calendar_id)
+        return 200
+
+class PushRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        # header names are case insensitive, handle_notification expects upper case
+        headers = dict((key.upper(), self.headers[key]) for key in self.headers.keys())
+        status = self.server.receiver.handle_notification(headers)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
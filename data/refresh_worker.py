@@ -0,0 +1,44 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+import threading
+
+class RefreshWorker():
+    """ Runs a job in a background thread and passes its result to a callback.
+    Only one job runs at a time: requests while a job is running are
+    coalesced into a single further run after it. """
+    def __init__(self, job, callback):
+        self.job = job
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.running = False
+        self.pending = False
+
+    def request(self):
+        with self.lock:
+            if self.running:
+                self.pending = True
+                return
+            self.running = True
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def is_busy(self):
+        return self.running
+
+    def run(self):
+        while True:
+            try:
+                result = self.job()
+            except Exception as e:
+                print e
+            else:
+                self.callback(result)
+            with self.lock:
+                if not self.pending:
+                    self.running = False
+                    return
+                self.pending = False
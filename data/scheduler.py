@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+from datetime import datetime
+import random
+
+# limits of the time between two polls (seconds)
+POLL_FLOOR = 60
+POLL_CEILING = 3600
+# polls are not further apart than the floor this close before an event starts or ends
+POLL_NEAR_TRANSITION = 900
+# factor the interval grows with after a poll without changes
+POLL_BACKOFF = 2.0
+# outside of these hours and on weekends the interval grows faster
+ACTIVE_HOURS = (7, 20)
+# after a failed poll the next try follows after RETRY_DELAY, doubled with
+# every further failure up to the ceiling and spread by +-RETRY_JITTER
+# so that many displays do not retry in lockstep
+RETRY_DELAY = 15
+RETRY_JITTER = 0.25
+
+def retry_delay(failures, first=RETRY_DELAY, ceiling=POLL_CEILING, jitter=RETRY_JITTER):
+    """ Returns the jittered exponential backoff after failures failed tries. """
+    delay = min(first * 2 ** max(failures - 1, 0), ceiling)
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+def is_quiet_time(now, active_hours=ACTIVE_HOURS):
+    """ Nights and weekends, when hardly anybody looks at the display. """
+    moment = datetime.fromtimestamp(now)
+    start_hour, end_hour = active_hours
+    return moment.weekday() >= 5 or not start_hour <= moment.hour < end_hour
+
+class AdaptivePollScheduler():
+    """ Decides when the calendar is polled next. Polls get more frequent
+    when the last ones found changes and shortly before the situation
+    changes, and back off exponentially after unchanged polls, at night
+    and on weekends. """
+    def __init__(self, floor=POLL_FLOOR, ceiling=POLL_CEILING, backoff=POLL_BACKOFF,
+                 near_transition=POLL_NEAR_TRANSITION, active_hours=ACTIVE_HOURS):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.backoff = backoff
+        self.near_transition = near_transition
+        self.active_hours = active_hours
+        self.interval = floor
+        self.last_poll = None
+        self.failures = 0  # failed polls in a row
+
+    def record_poll(self, now, changes):
+        """ Adapts the interval to the result of a poll. """
+        self.last_poll = now
+        if changes or self.failures:
+            self.failures = 0
+            self.interval = self.floor
+        else:
+            backoff = self.backoff
+            if self.is_quiet_time(now):
+                backoff *= backoff
+            self.interval = min(self.interval * backoff, self.ceiling)
+
+    def record_failure(self, now):
+        """ Retries a failed poll with a jittered exponential backoff. """
+        self.last_poll = now
+        self.failures += 1
+        self.interval = retry_delay(self.failures, ceiling=self.ceiling)
+
+    def is_quiet_time(self, now):
+        return is_quiet_time(now, self.active_hours)
+
+    def next_poll(self, now, next_transition=None):
+        """ Returns when to poll next. next_transition is the time the
+        situation changes next, if known. """
+        if self.last_poll is None:
+            return now
+        next_poll = self.last_poll + self.interval
+        if next_transition is not None and next_transition - now <= self.near_transition:
+            # poll just before the transition to have its changes in time
+            next_poll = min(next_poll, max(self.last_poll + self.floor, next_transition - self.floor))
+        return next_poll
@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+""" Startup profiling for "python main.py --profile-startup": records the
+time of every import that loads new modules, the phases of the backend
+(reading the cache, authentication, discovery, fetching) and when the
+first frame and the first fetched situation appeared. As soon as both
+happened, the report is printed and written to PROFILE_FILE as JSON.
+
+Without the option all functions of this module do nothing. """
+
+import __builtin__
+import json
+import sys
+import threading
+import time
+
+PROFILE_FILE = "startup_profile.json"
+# the report is written once all of these moments were marked
+REPORT_MARKS = ("first_frame", "first_situation")
+# imports that took less than this are left out of the report (seconds)
+MIN_IMPORT_TIME = 0.001
+
+profiler = None
+
+def start(start_time):
+    """ Starts profiling, start_time being the very beginning of the program. """
+    global profiler
+    profiler = StartupProfiler(start_time)
+    profiler.install_import_hook()
+
+def phase(name):
+    """ Returns a context manager that records the duration of a phase. """
+    if profiler is None:
+        return NO_PHASE
+    return Phase(profiler, name)
+
+def mark(name):
+    """ Records when something happened for the first time. """
+    if profiler is not None:
+        profiler.mark(name)
+
+class StartupProfiler():
+    def __init__(self, start_time):
+        self.start_time = start_time
+        self.lock = threading.Lock()
+        self.imports = []  # (module, start, seconds, depth, modules loaded)
+        self.phases = []  # (name, start, seconds, thread)
+        self.marks = {}
+        self.local = threading.local()  # depth of the nested imports per thread
+        self.original_import = None
+        self.reported = False
+
+    def install_import_hook(self):
+        self.original_import = __builtin__.__import__
+        __builtin__.__import__ = self.timed_import
+
+    def remove_import_hook(self):
+        if self.original_import is not None:
+            __builtin__.__import__ = self.original_import
+            self.original_import = None
+
+    def timed_import(self, name, *args, **kwargs):
+        module_count = len(sys.modules)
+        start = time.time()
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        try:
+            return self.original_import(name, *args, **kwargs)
+        finally:
+            self.local.depth = depth
+            loaded = len(sys.modules) - module_count
+            if loaded:
+                # only imports that actually loaded something are of interest
+                with self.lock:
+                    self.imports.append((name, start - self.start_time, time.time() - start,
+                                         depth, loaded))
+
+    def add_phase(self, name, start, seconds):
+        with self.lock:
+            self.phases.append((name, start - self.start_time, seconds,
+                                threading.current_thread().name))
+
+    def mark(self, name):
+        with self.lock:
+            if name in self.marks:
+                return
+            self.marks[name] = time.time() - self.start_time
+            complete = all(required in self.marks for required in REPORT_MARKS)
+            if not complete or self.reported:
+                return
+            self.reported = True
+        self.remove_import_hook()
+        self.report()
+
+    def get_report(self):
+        imports = [{"module": name, "start": start, "seconds": seconds, "depth": depth, "modules": loaded}
+                   for name, start, seconds, depth, loaded in self.imports if seconds >= MIN_IMPORT_TIME]
+        phases = [{"phase": name, "start": start, "seconds": seconds, "thread": thread}
+                  for name, start, seconds, thread in self.phases]
+        return {"import_seconds": sum(seconds for name, start, seconds, depth, loaded in self.imports if depth == 0),
+                "modules_loaded": sum(loaded for name, start, seconds, depth, loaded in self.imports if depth == 0),
+                "imports": imports,
+                "phases": phases,
+                "marks": self.marks}
+
+    def report(self):
+        report = self.get_report()
+        print "Startup profile:"
+        print "  imports: {:.0f} ms, {} modules".format(report["import_seconds"] * 1000, report["modules_loaded"])
+        top_level = sorted((entry for entry in report["imports"] if entry["depth"] == 0),
+                           key=lambda entry: -entry["seconds"])
+        for entry in top_level[:10]:
+            print "    {:<40} {:7.1f} ms".format(entry["module"], entry["seconds"] * 1000)
+        for entry in report["phases"]:
+            print "  {:<42} {:7.1f} ms (at {:.0f} ms)".format(entry["phase"], entry["seconds"] * 1000,
+                                                               entry["start"] * 1000)
+        for name, moment in sorted(report["marks"].items(), key=lambda item: item[1]):
+            print "  {:<42} at {:.0f} ms".format(name, moment * 1000)
+        try:
+            file_object = open(PROFILE_FILE, 'w')
+            json.dump(report, file_object, indent=2, sort_keys=True)
+            file_object.close()
+        except IOError:
+            print "Could not write to file %s." % PROFILE_FILE
+
+class Phase():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add_phase(self.name, self.start, time.time() - self.start)
+        return False
+
+class NoPhase():
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NO_PHASE = NoPhase()
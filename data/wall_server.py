@@ -0,0 +1,219 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+""" Display-wall mode: one headless server keeps the situation of a
+calendar backend in memory and many lightweight displays get it via
+HTTP long-polling, so the load on the Calendar API does not grow with
+the number of screens.
+
+Server:  python -m data.wall_server [--port 8765]
+Display: python main.py --wall-server http://server:8765 """
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from data.events import Situation, SimpleEvent
+from data.scheduler import retry_delay
+import argparse
+import json
+import threading
+import time
+import urllib2
+import urlparse
+
+WALL_PORT = 8765
+# a long-poll request is answered after this time even without a change
+LONG_POLL_TIMEOUT = 25
+# displays wait this long before they try again after an error,
+# doubled with every further error up to CLIENT_RETRY_MAX
+CLIENT_RETRY_DELAY = 10
+CLIENT_RETRY_MAX = 300
+
+def encode_event(event):
+    if event is None:
+        return None
+    return {"title": event.title, "start": event.start, "end": event.end,
+            "description": event.description, "location": event.location,
+            "google_id": event.google_id}
+
+def decode_event(content):
+    if content is None:
+        return None
+    return SimpleEvent(content["title"], content["start"], content["end"],
+                       content["description"], content["location"], content["google_id"])
+
+def encode_situation(situation):
+    return {"last": encode_event(situation.last),
+            "current": encode_event(situation.current),
+            "next": encode_event(situation.next)}
+
+def decode_situation(content):
+    return Situation(decode_event(content["last"]), decode_event(content["current"]),
+                     decode_event(content["next"]))
+
+class WallServer():
+    """ Keeps the situation of one backend in memory and hands every
+    new version of it to the waiting displays. """
+    def __init__(self, backend, port=WALL_PORT):
+        self.backend = backend
+        self.port = port
+        self.condition = threading.Condition()
+        self.version = 0
+        self.snapshot = None
+        self.wake_event = threading.Event()
+
+    def publish(self, situation):
+        """ Stores the situation as new version if it differs from the current one. """
+        snapshot = encode_situation(situation)
+        with self.condition:
+            if snapshot == self.snapshot:
+                return False
+            self.version += 1
+            self.snapshot = snapshot
+            self.condition.notify_all()
+        return True
+
+    def wait_for_change(self, version, timeout=LONG_POLL_TIMEOUT):
+        """ Blocks until there is a newer version than version
+        or the timeout passed, returns the current version and situation. """
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.version == version or self.snapshot is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.version, self.snapshot
+
+    def update(self):
+        """ Refreshes the backend if a poll is due and publishes the current
+        situation. Returns the time of the next update. """
+        now = time.time()
+        if now >= self.backend.get_next_poll(now):
+            self.backend.refresh()
+        self.publish(self.backend.get_current_situation())
+        now = time.time()
+        next_update = self.backend.get_next_poll(now)
+        transition = self.backend.get_next_transition(now)
+        if transition is not None:
+            next_update = min(next_update, transition)
+        return next_update
+
+    def run_updates(self):
+        self.publish(self.backend.get_cached_situation())
+        while True:
+            try:
+                next_update = self.update()
+            except Exception as e:
+                print e
+                next_update = time.time() + CLIENT_RETRY_DELAY
+            self.wake_event.wait(max(next_update - time.time(), 0.1))
+            self.wake_event.clear()
+
+    def wake(self):
+        """ Publishes the situation right away, e.g. after a push notification. """
+        self.wake_event.set()
+
+    def serve_forever(self):
+        thread = threading.Thread(target=self.run_updates)
+        thread.daemon = True
+        thread.start()
+        httpd = ThreadingHTTPServer(("", self.port), WallRequestHandler)
+        httpd.wall = self
+        print "Serving situations on port {}.".format(self.port)
+        httpd.serve_forever()
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class WallRequestHandler(BaseHTTPRequestHandler):
+    """ GET /situation?version=N answers as soon as there is a version newer
+    than N (immediately without N) with {"version": ..., "situation": ...}. """
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != "/situation":
+            self.send_error(404)
+            return
+        query = urlparse.parse_qs(url.query)
+        try:
+            version = int(query.get("version", ["-1"])[0])
+        except ValueError:
+            self.send_error(400)
+            return
+        version, snapshot = self.server.wall.wait_for_change(version)
+        body = json.dumps({"version": version, "situation": snapshot})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class WallClient():
+    """ Backend for a display of a wall server. It does not authenticate and
+    does not fetch events, every call of get_current_situation waits for
+    the next situation from the server. """
+    pushes_situations = True
+
+    def __init__(self, url):
+        self.url = url.rstrip("/") + "/situation"
+        self.version = -1
+        self.situation = Situation()
+        self.received_at = None
+        self.failures = 0
+
+    def get_cached_situation(self):
+        return self.situation
+
+    def get_current_situation(self):
+        try:
+            response = urllib2.urlopen("{}?version={:d}".format(self.url, self.version),
+                                       timeout=LONG_POLL_TIMEOUT + 10)
+            content = json.load(response)
+            response.close()
+        except (EnvironmentError, ValueError) as e:
+            # keep showing the last situation
+            print "Wall server not reachable: {}".format(e)
+            self.failures += 1
+            time.sleep(retry_delay(self.failures, CLIENT_RETRY_DELAY, CLIENT_RETRY_MAX))
+            return self.situation
+        self.failures = 0
+        self.received_at = time.time()
+        if content["situation"] is not None:
+            self.version = content["version"]
+            self.situation = decode_situation(content["situation"])
+        return self.situation
+
+    def get_next_transition(self, ts):
+        # the server sends the new situation at every transition
+        return None
+
+    def get_next_poll(self, now):
+        # the server polls the calendar
+        return None
+
+    def get_stale_age(self, now):
+        if not self.failures or self.received_at is None:
+            return None
+        return now - self.received_at
+
+    def refresh(self):
+        return 0
+
+    def logout(self):
+        pass
+
+if __name__ == '__main__':
+    from data.calendar_backend import GoogleCalendarBackend
+    parser = argparse.ArgumentParser(description="Serves the situation to Scholaris displays.")
+    parser.add_argument("--port", type=int, default=WALL_PORT)
+    parser.add_argument("--push-webhook", help="public URL for change notifications, see data/push.py")
+    args, unknown = parser.parse_known_args()
+    backend = GoogleCalendarBackend()
+    server = WallServer(backend, args.port)
+    if args.push_webhook:
+        backend.start_push(args.push_webhook, on_change=server.wake)
+    server.serve_forever()
@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright Tim Henning 2014
+
+""" Warm-up stage of the startup: loads what the first card swap would
+otherwise read from disk. The cards of the card pool have no text until
+they show an event, so their fonts would only be opened then.
+
+The images of data/media are packed into one atlas. Kivy drops single
+images from its texture cache after a minute, loaded atlases stay. """
+
+from kivy.atlas import Atlas
+from kivy.base import EventLoop
+from kivy.cache import Cache
+from kivy.core.text import Label as CoreLabel
+from kivy.metrics import sp
+import glob
+import os
+
+MEDIA_DIR = "data/media"
+# written next to data/media, not into it, so that it is not packed itself
+ATLAS_NAME = "data/media_atlas"
+ATLAS_SIZE = 256
+# font and size of the labels of the cards and break labels, see scholaris.kv
+CARD_FONTS = (("data/Caviar Dreams Bold.ttf", 26),
+              ("data/Caviar Dreams Bold.ttf", 20),
+              ("data/Existence-Light.ttf", 20),
+              ("data/Existence-Light.ttf", 16))
+# the characters of format_time_in_seconds, format_time_as_break and the clock times
+GLYPHS = "0123456789 :hms left min"
+
+atlas_loaded = False
+
+def warm_up():
+    EventLoop.ensure_window()  # textures need the GL context
+    preload_fonts()
+    pack_media()
+
+def preload_fonts():
+    """ Opens every font of the cards and renders the digits and units once
+    in every size, the text providers keep both the fonts and the glyphs. """
+    for font_name, font_size in CARD_FONTS:
+        label = CoreLabel(text=GLYPHS, font_name=font_name, font_size=sp(font_size))
+        label.refresh()
+
+def pack_media():
+    """ Packs the images into the atlas if they changed since the last start
+    and loads it. Without PIL the single images are used. """
+    global atlas_loaded
+    images = sorted(glob.glob(os.path.join(MEDIA_DIR, "*.png")))
+    atlas_file = ATLAS_NAME + ".atlas"
+    if not is_up_to_date(atlas_file, images):
+        try:
+            if not Atlas.create(ATLAS_NAME, images, ATLAS_SIZE):
+                print "The media do not fit into an atlas of {0}x{0}.".format(ATLAS_SIZE)
+                return
+        except (ImportError, EnvironmentError) as e:
+            print "Could not pack the media into an atlas: {}".format(e)
+            return
+    # the key atlas:// sources look for
+    Cache.append("kv.atlas", ATLAS_NAME, Atlas(atlas_file))
+    atlas_loaded = True
+
+def is_up_to_date(target, sources):
+    if not os.path.exists(target):
+        return False
+    modified = os.path.getmtime(target)
+    return all(os.path.getmtime(source) <= modified for source in sources)
+
+def media_source(name):
+    """ Source of the image data/media/<name>.png for kv rules. """
+    if atlas_loaded:
+        return "atlas://{}/{}".format(ATLAS_NAME, name)
+    return "{}/{}.png".format(MEDIA_DIR, name)
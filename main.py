@@ -3,84 +3,209 @@
 #
 # Copyright Tim Henning 2014
 
+import time
+START_TIME = time.time()  # taken before the other imports to measure the time to first frame
+
+# the options of Scholaris have to be removed before Kivy parses the command line
+from data.command_line import pop_option
+# show the situations of a wall server instead of fetching them (see data/wall_server.py)
+WALL_SERVER_URL = pop_option("--wall-server", takes_value=True)
+# receive change notifications from Google at this public URL (see data/push.py)
+PUSH_WEBHOOK_URL = pop_option("--push-webhook", takes_value=True)
+# time the imports and the phases of the startup (see data/startup_profile.py)
+PROFILE_STARTUP = pop_option("--profile-startup")
+# frame rate and decoration movement (see data/power.py), --stats shows the usage
+POWER_PROFILE_NAME = pop_option("--power-profile", takes_value=True, default="normal")
+SHOW_STATS = pop_option("--stats")
+
+from data import startup_profile
+if PROFILE_STARTUP:
+    startup_profile.start(START_TIME)
+
 from data.calendar_backend import GoogleCalendarBackend
+from data.events import Situation
+from data.power import UsageMonitor, get_power_profile
+from data.refresh_worker import RefreshWorker
+from data.wall_server import WallClient
 from datetime import datetime, timedelta
+from kivy.config import Config
+POWER_PROFILE = get_power_profile(POWER_PROFILE_NAME)
+Config.set('graphics', 'maxfps', str(POWER_PROFILE.max_fps))  # read when the clock is created
 from kivy.app import App
 from kivy.clock import Clock
+from kivy.core.window import Window
 from kivy.metrics import dp
 from kivy.properties import StringProperty, NumericProperty
 from kivy.uix.anchorlayout import AnchorLayout
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.floatlayout import FloatLayout
-import data.decorations  # register decorations for kv file
+from data.decorations import animator  # also registers the decorations for the kv file
+from data import warmup
 import kivy.base
-import time
 
 class Scholaris(App):
     
     def build(self):
-        self.situation = (None, None, None)
+        self.situation = Situation()
         self.current_card = None
+        self.sync_requested = False
+        # fonts and images before the cards are built, see data/warmup.py
+        with startup_profile.phase("warm up"):
+            warmup.warm_up()
         self.gui = GUI()
         self.gui.scroll_view.bind(scroll_y=self.on_scroll)
-        self.calendar_backend = GoogleCalendarBackend()
-        self.get_situation()
-        Clock.schedule_interval(self.update_timer, 1)
+        self.card_pool = CardPool(self.gui)
+        self.calendar_backend = self.create_backend()
+        self.refresh_worker = RefreshWorker(self.fetch_situation, self.publish_situation)
+        # draw the last known situation from the cache right away,
+        # authentication and fetching happen in the refresh worker
+        with startup_profile.phase("cached situation"):
+            self.situation = self.calendar_backend.get_cached_situation()
+            self.build_gui_situation()
+        self.schedule_transition()
+        self.get_situation(sync=True)
+        self.usage_monitor = UsageMonitor() if SHOW_STATS else None
+        self.update_power_mode()
+        Clock.schedule_interval(self.update_power_mode, 60)
+        self.start_timer()
+        # the countdown is not updated while nobody can see it
+        Window.bind(on_hide=self.stop_timer, on_minimize=self.stop_timer,
+                    on_show=self.start_timer, on_restore=self.start_timer)
+        # a callback of the clock would run before the first frame is drawn
+        Window.bind(on_flip=self.on_first_frame)
         return self.gui
     
-    def get_situation(self, trigger=None, value=None):
-        self.situation = self.calendar_backend.get_current_situation()
-        self.build_gui_situation()
+    def create_backend(self):
+        if WALL_SERVER_URL:
+            return WallClient(WALL_SERVER_URL)
+        backend = GoogleCalendarBackend()
+        if PUSH_WEBHOOK_URL:
+            backend.start_push(PUSH_WEBHOOK_URL, on_change=self.get_situation)
+        return backend
+    
+    def on_first_frame(self, window=None):
+        Window.unbind(on_flip=self.on_first_frame)
+        self.time_to_first_frame = time.time() - START_TIME
+        print "Time to first frame: {:.0f} ms".format(self.time_to_first_frame * 1000)
+        startup_profile.mark("first_frame")
+    
+    def get_situation(self, sync=False):
+        """ Requests a new situation from the refresh worker,
+        the GUI is updated when it arrives. """
+        if sync:
+            self.sync_requested = True
+        self.refresh_worker.request()
+    
+    def fetch_situation(self):
+        """ Runs in the thread of the refresh worker. """
+        if self.sync_requested:
+            self.sync_requested = False
+            self.calendar_backend.refresh()
+        return self.calendar_backend.get_current_situation()
+    
+    def publish_situation(self, situation):
+        """ Called by the refresh worker, hands the situation to the main loop. """
+        Clock.schedule_once(lambda dt: self.set_situation(situation))
+    
+    def set_situation(self, situation):
+        startup_profile.mark("first_situation")
+        if situation is not self.situation:
+            # the event index returns the same object while nothing changed
+            self.situation = situation
+            self.build_gui_situation()
+            self.update_timer()
+        self.schedule_transition()
+        self.schedule_poll()
+        if self.calendar_backend.pushes_situations:
+            # wait for the next situation from the wall server
+            self.get_situation()
+    
+    def schedule_transition(self):
+        """ Arms a single timer for the next change of the situation:
+        an event starts or ends or the day is over. """
+        Clock.unschedule(self.on_transition)
+        now = time.time()
+        transition = self.get_end_of_day()
+        next_change = self.calendar_backend.get_next_transition(now)
+        if next_change is not None:
+            transition = min(transition, next_change)
+        Clock.schedule_once(self.on_transition, max(transition - now, 0))
+    
+    def on_transition(self, trigger=None):
+        # the situation follows from the local events, fetching is left to schedule_poll
+        self.get_situation()
+    
+    def schedule_poll(self):
+        """ Arms the timer for the next poll of the calendar, the backend
+        adapts the interval to event proximity and recent changes. """
+        Clock.unschedule(self.on_poll)
+        now = time.time()
+        next_poll = self.calendar_backend.get_next_poll(now)
+        if next_poll is not None:
+            Clock.schedule_once(self.on_poll, max(next_poll - now, 1))
+    
+    def on_poll(self, trigger=None):
+        self.get_situation(sync=True)
     
     def build_gui_situation(self):
-        self.clear_gui()
         gui = self.gui
         situation = self.situation
-        if situation.last:
-            card = NoneCurrentEventCard(situation.last)
-            gui.layout_last_event.add_widget(card)
-        if situation.current:
-            card = CurrentEventCard(situation.current)
-            gui.layout_current_event.add_widget(card)
-            self.current_card = card
-        else:
-            card = BreakCard()
-            gui.layout_current_event.add_widget(card)
-            self.current_card = card
-        if situation.next:
-            card = NoneCurrentEventCard(situation.next)
-            gui.layout_next_event.add_widget(card)
+        self.current_card = self.card_pool.show(situation)
+        gui.last_break_label.text = ""
+        gui.next_break_label.text = ""
         if situation.has_last_break():
             gui.last_break_label.text = self.format_time_as_break(situation.get_last_break_length())
         if situation.has_next_break():
             gui.next_break_label.text = self.format_time_as_break(situation.get_next_break_length())
-        
-    def clear_gui(self):
-        gui = self.gui
-        gui.layout_last_event.clear_widgets()
-        gui.layout_current_event.clear_widgets()
-        gui.layout_next_event.clear_widgets()
-        gui.last_break_label.text = ""
-        gui.next_break_label.text = ""
     
     def update_timer(self, trigger=None, value=None):
+        """ Updates the countdown once per second. The situation itself
+        is renewed by the timer of schedule_transition. """
+        self.update_status()
+        if self.usage_monitor:
+            self.update_stats()
         situation = self.situation
         time_left = self.get_time_left(situation)
         if time_left <= 0:
-            # current situation is not up to date
-            return self.get_situation()
+            # the transition was missed, e.g. because the worker was busy
+            if not self.refresh_worker.is_busy():
+                self.get_situation()
+            return
         if self.current_card:
             if situation.is_freetime():
                 # freetime: after last event
                 # display a Clock
                 time_left_string = time.strftime('%H:%M:%S')
             else:
-                time_left_string = self.format_time_in_seconds(self.get_time_left(situation))
+                time_left_string = self.format_time_in_seconds(time_left)
             self.current_card.time_left_string = time_left_string
             if situation.relative_position_available():
-                # display a vertical "progress bar"
+                # display a vertical "progress bar", moved in steps in the low power profiles
                 current_length = situation.get_current_length()
-                self.current_card.marker_pos = float(current_length - time_left) / current_length
+                marker_pos = float(current_length - time_left) / current_length
+                if abs(marker_pos - self.current_card.marker_pos) >= POWER_PROFILE.marker_step:
+                    self.current_card.marker_pos = marker_pos
+    
+    def update_power_mode(self, trigger=None):
+        """ Slows down or stops the decorations outside the active hours. """
+        animator.set_mode(POWER_PROFILE.get_decoration_mode(time.time()))
+    
+    def update_stats(self):
+        """ Shows the profile, frame rates and CPU usage in the stats overlay.
+        Redraws per second (rfps) stand for the load of the GPU. """
+        cpu = self.usage_monitor.sample()
+        if cpu is None:
+            return
+        self.gui.stats_string = "{}: {:.0f} fps, {:.0f} redraws/s, CPU {:.1f}%, decorations {}".format(
+            POWER_PROFILE.name, Clock.get_fps(), Clock.get_rfps(), cpu * 100, animator.mode)
+    
+    def update_status(self):
+        """ Shows the age of the displayed events while the calendar is not reachable. """
+        age = self.calendar_backend.get_stale_age(time.time())
+        if age is None:
+            self.gui.status_string = ""
+        else:
+            self.gui.status_string = "Offline, updated {} ago".format(self.format_time_as_break(age))
     
     def get_time_left(self, situation):
         if situation.current:
@@ -91,10 +216,12 @@ class Scholaris(App):
             return situation.next.start - time.time()
         else:
             # time till end of day
-            day = datetime.now() + timedelta(days=1)
-            dt = datetime(year=day.year, month=day.month, day=day.day)
-            end_of_day = time.mktime(dt.timetuple())
-            return end_of_day - time.time()
+            return self.get_end_of_day() - time.time()
+    
+    def get_end_of_day(self):
+        day = datetime.now() + timedelta(days=1)
+        dt = datetime(year=day.year, month=day.month, day=day.day)
+        return time.mktime(dt.timetuple())
     
     def format_time_in_seconds(self, time):
         hours = int(time / 3600)
@@ -124,18 +251,70 @@ class Scholaris(App):
         self.calendar_backend.logout()
         self.stop()
     
-    def on_pause(self):
+    def start_timer(self, window=None):
         Clock.unschedule(self.update_timer)
+        Clock.schedule_interval(self.update_timer, 1)
+        self.update_timer()  # it is behind after a pause
+    
+    def stop_timer(self, window=None):
+        Clock.unschedule(self.update_timer)
+    
+    def on_pause(self):
+        self.stop_timer()
         return True
     
     def on_resume(self):
-        Clock.schedule_interval(self.update_timer, 1)
+        self.start_timer()
+        # transitions may have been missed while paused
+        self.get_situation(sync=True)
         return True
 
 class GUI(FloatLayout):
     last_event_string = StringProperty("")
     current_event_string = StringProperty("")
     next_event_string = StringProperty("")
+    status_string = StringProperty("")
+    stats_string = StringProperty("")
+
+class CardPool():
+    """ Keeps one card per slot of the GUI. When the situation changes, only
+    the properties of the cards are set again and cards are moved in or out
+    of their slot, no card is built twice. """
+    def __init__(self, gui):
+        self.gui = gui
+        self.last_card = NoneCurrentEventCard()
+        self.current_card = CurrentEventCard()
+        self.break_card = BreakCard()
+        self.next_card = NoneCurrentEventCard()
+    
+    def show(self, situation):
+        """ Shows the situation and returns the card in the middle slot. """
+        gui = self.gui
+        self.show_event(gui.layout_last_event, self.last_card, situation.last)
+        if situation.current:
+            current_card = self.current_card
+            self.show_event(gui.layout_current_event, current_card, situation.current)
+        else:
+            current_card = self.break_card
+            current_card.reset()
+            self.place(gui.layout_current_event, current_card)
+        self.show_event(gui.layout_next_event, self.next_card, situation.next)
+        return current_card
+    
+    def show_event(self, layout, card, event):
+        if event is None:
+            self.place(layout, None)
+        else:
+            card.show_event(event)
+            self.place(layout, card)
+    
+    def place(self, layout, card):
+        """ Makes card the only child of layout, None empties it. """
+        if card is not None and card.parent is layout:
+            return
+        layout.clear_widgets()
+        if card is not None:
+            layout.add_widget(card)
 
 class NoneCurrentEventCard(BoxLayout):
     """ Layout of a card that displays title, start,
@@ -145,15 +324,17 @@ class NoneCurrentEventCard(BoxLayout):
     title = StringProperty("")
     description = StringProperty("")
     location = StringProperty("")
-    def __init__(self, event, **kwargs):
+    def __init__(self, event=None, **kwargs):
         super(NoneCurrentEventCard, self).__init__(**kwargs)
+        if event:
+            self.show_event(event)
+    
+    def show_event(self, event):
         self.title = event.title
         self.description = event.description
         self.location = event.location
-        time_to_format = datetime.fromtimestamp(event.start)
-        self.start_time = "{:d}:{:02d}".format(time_to_format.hour, time_to_format.minute)
-        time_to_format = datetime.fromtimestamp(event.end)
-        self.end_time = "{:d}:{:02d}".format(time_to_format.hour, time_to_format.minute)
+        self.start_time = event.start_time
+        self.end_time = event.end_time
 
 class CurrentEventCard(BoxLayout):
     """ Layout of a card that displays title, start,
@@ -166,21 +347,30 @@ class CurrentEventCard(BoxLayout):
     location = StringProperty("")
     time_left_string = StringProperty("")
     marker_pos = NumericProperty(0)
-    def __init__(self, event, **kwargs):
+    def __init__(self, event=None, **kwargs):
         super(CurrentEventCard, self).__init__(**kwargs)
+        if event:
+            self.show_event(event)
+    
+    def show_event(self, event):
         self.title = event.title
         self.description = event.description
         self.location = event.location
-        time_to_format = datetime.fromtimestamp(event.start)
-        self.start_time = "{:d}:{:02d}".format(time_to_format.hour, time_to_format.minute)
-        time_to_format = datetime.fromtimestamp(event.end)
-        self.end_time = "{:d}:{:02d}".format(time_to_format.hour, time_to_format.minute)
+        self.start_time = event.start_time
+        self.end_time = event.end_time
+        # the countdown of the previous event must not stay visible
+        self.time_left_string = ""
+        self.marker_pos = 0
 
 class BreakCard(AnchorLayout):
     """ Layout that does not look like a card
     but displays the time left till the next event"""
     time_left_string = StringProperty("")
     marker_pos = NumericProperty(0)
+    
+    def reset(self):
+        self.time_left_string = ""
+        self.marker_pos = 0
 
 if __name__ in ('__android__', '__main__'):
     Scholaris().run()
\ No newline at end of file